@@ -0,0 +1,159 @@
+import itertools
+
+import numpy as np
+
+from app.atributos import COLUMNAS_FILTRO, clave_valor, valores_filtro
+
+# --- Ampliación local de filtros: la menor relajación que alcanza un mínimo de productos ---
+
+# Familias de colores de basecolour: ampliar un color es pasar a toda su familia
+FAMILIAS_COLOR = [
+    ["Red", "Maroon", "Burgundy", "Rust", "Coffee Brown"],
+    ["Pink", "Magenta", "Peach", "Rose", "Mauve", "Lavender"],
+    ["Blue", "Navy Blue", "Turquoise Blue", "Teal", "Sea Green"],
+    ["Green", "Olive", "Lime Green", "Fluorescent Green", "Sea Green"],
+    ["Black", "Charcoal", "Grey", "Grey Melange", "Steel", "Metallic"],
+    ["White", "Off White", "Cream", "Beige", "Skin", "Nude"],
+    ["Brown", "Coffee Brown", "Tan", "Khaki", "Taupe", "Mushroom Brown", "Bronze", "Copper"],
+    ["Yellow", "Mustard", "Gold", "Orange"],
+    ["Purple", "Lavender", "Mauve", "Magenta"],
+    ["Silver", "Steel", "Grey", "Metallic"],
+    ["Multi"],
+]
+
+# Valores afines fijos en otras columnas
+ESTACIONES_VECINAS = {"Summer": ["Spring"], "Spring": ["Summer"], "Fall": ["Winter"], "Winter": ["Fall"]}
+GENEROS_AFINES = {"Men": ["Unisex"], "Women": ["Unisex"], "Boys": ["Unisex"], "Girls": ["Unisex"], "Unisex": ["Men", "Women"]}
+
+# Columna "padre" con la que se agrupan por coocurrencia los valores de una columna:
+# un articletype se amplía a los de su misma subcategory, y esta a las de su mastercategory
+AGRUPAR_POR = {"articletype": "subcategory", "subcategory": "mastercategory"}
+
+# Coste de ampliar una columna a valores afines y de quitarla del filtro.
+# Las columnas que más cambian lo que busca el cliente son las más caras de quitar.
+COSTE_AMPLIAR = 1.0
+COSTE_QUITAR = {
+    "year": 1.0, "season": 1.5, "usage": 2.0, "basecolour": 3.0,
+    "subcategory": 3.0, "mastercategory": 4.0, "articletype": 5.0, "gender": 6.0,
+}
+
+# Bits a 1 de cada byte, para contar sobre los bitmaps empaquetados
+_BITS = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+
+def contar_bits(bitmap):
+    return int(_BITS[bitmap].sum(dtype=np.int64))
+
+
+class AmpliadorFiltros:
+    """
+    Elige, con recuentos exactos del índice de atributos, la ampliación más
+    barata que deja al menos `minimo` productos. Cada columna del filtro se
+    puede mantener, ampliar a valores afines (familia de color, tipos de
+    artículo de la misma subcategoría, estación o año vecinos...) o quitar.
+
+    Los grupos por coocurrencia se calculan una vez por versión del índice.
+    """
+
+    def __init__(self, indice_atributos):
+        self.indice = indice_atributos
+        self.afines = {col: {} for col in COLUMNAS_FILTRO}
+
+        vocabulario = indice_atributos.vocabulario
+        colores = set(vocabulario.get("basecolour", []))
+        for familia in FAMILIAS_COLOR:
+            presentes = [c for c in familia if c in colores]
+            for c in presentes:
+                self.afines["basecolour"].setdefault(c, set()).update(presentes)
+
+        for col, tabla in (("season", ESTACIONES_VECINAS), ("gender", GENEROS_AFINES)):
+            existentes = set(vocabulario.get(col, []))
+            for valor, vecinos in tabla.items():
+                if valor in existentes:
+                    self.afines[col][valor] = {valor} | {v for v in vecinos if v in existentes}
+
+        anios = {v for v in vocabulario.get("year", []) if v.isdigit()}
+        for anio in anios:
+            self.afines["year"][anio] = {a for a in (str(int(anio) + d) for d in (-1, 0, 1)) if a in anios}
+
+        for col, padre in AGRUPAR_POR.items():
+            grupos = {}
+            for valor, bm in indice_atributos.bitmaps.get(col, {}).items():
+                if valor is None:
+                    continue
+                # Valor de la columna padre con el que más productos comparte
+                solapes = {
+                    p: contar_bits(np.bitwise_and(bm, bm_padre))
+                    for p, bm_padre in indice_atributos.bitmaps.get(padre, {}).items() if p is not None
+                }
+                if solapes:
+                    grupos.setdefault(max(solapes, key=solapes.get), set()).add(valor)
+            for miembros in grupos.values():
+                for valor in miembros:
+                    self.afines[col][valor] = miembros
+
+    def _bitmap_columna(self, col, valores):
+        return self.indice.bitmap({col: sorted(valores)})
+
+    def _opciones(self, col, val):
+        """[(coste, valores o None si se quita, bitmap)] de una columna del filtro."""
+        actuales = {clave_valor(v) for v in valores_filtro(val)} - {None}
+        opciones = [(0.0, actuales, self._bitmap_columna(col, actuales))]
+        ampliados = set(actuales)
+        for v in actuales:
+            ampliados |= self.afines.get(col, {}).get(v, set())
+        if ampliados != actuales:
+            opciones.append((COSTE_AMPLIAR, ampliados, self._bitmap_columna(col, ampliados)))
+        opciones.append((COSTE_QUITAR.get(col, 1.0), None, None))
+        return opciones
+
+    def ampliar(self, filtros, minimo):
+        """
+        (filtros ampliados, nº de productos, cambios legibles) con la menor
+        ampliación que alcanza `minimo`; a igual coste, la que menos productos
+        añade. None si solo se llega quitando todos los filtros.
+
+        Las columnas que no están en COLUMNAS_FILTRO no se pueden filtrar (sin
+        ellas no habría resultados): se quitan y constan en `cambios`.
+        """
+        columnas = [col for col in filtros if col in COLUMNAS_FILTRO]
+        if not columnas:
+            return None
+        opciones = [self._opciones(col, filtros[col]) for col in columnas]
+
+        combinaciones = sorted(
+            itertools.product(*opciones),
+            key=lambda combo: sum(coste for coste, _, _ in combo)
+        )
+        mejor, coste_mejor = None, None
+        for combo in combinaciones:
+            coste = sum(c for c, _, _ in combo)
+            if coste == 0 or all(valores is None for _, valores, _ in combo):
+                continue
+            if coste_mejor is not None and coste > coste_mejor:
+                break
+            resultado = self.indice.bitmap({})
+            for _, valores, bm in combo:
+                if bm is not None:
+                    np.bitwise_and(resultado, bm, out=resultado)
+            n = contar_bits(resultado)
+            if n >= minimo and (mejor is None or n < mejor[1]):
+                mejor, coste_mejor = (combo, n), coste
+        if mejor is None:
+            return None
+
+        combo, n = mejor
+        nuevos = {}
+        cambios = [f"sin {col}" for col in filtros if col not in COLUMNAS_FILTRO]
+        for col, (coste, valores, _) in zip(columnas, combo):
+            if valores is None:
+                cambios.append(f"sin {col}")
+                continue
+            valores = sorted(valores)
+            nuevos[col] = valores if len(valores) > 1 or isinstance(filtros[col], (list, tuple, set)) else valores[0]
+            if coste > 0:
+                cambios.append(f"{col}: {', '.join(valores)}")
+        return nuevos, n, cambios
+
+
+__all__ = ["FAMILIAS_COLOR", "COSTE_QUITAR", "AmpliadorFiltros"]
@@ -0,0 +1,95 @@
+import os
+from datetime import datetime
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from app.config import INDEX_DIR
+from app.db import leer_sql
+from app.atributos import COLUMNAS_FILTRO
+from app.artefactos import leer_json, guardar_json
+from app.indice import leer_meta_indice, meta_compatible
+
+# Catálogo de productos (presentación + columnas filtrables) en Parquet, ordenado
+# por product_id. Las features siguen en productos_features.npy, mapeadas en memoria.
+RUTA_CATALOGO = os.path.join(INDEX_DIR, "catalogo.parquet")
+RUTA_CATALOGO_META = os.path.join(INDEX_DIR, "catalogo_meta.json")
+
+# Huella de products calculada en el servidor (solo viaja una fila): filas, último id y
+# md5 de las columnas exportadas, para detectar altas, bajas y ediciones
+query_huella_productos = f"""
+SELECT COUNT(*) AS n, MAX(id) AS max_id,
+       md5(string_agg(md5(ROW(id, productdisplayname, image_url, {", ".join(COLUMNAS_FILTRO)})::text), '' ORDER BY id)) AS md5
+FROM products
+"""
+
+
+def huella_productos():
+    """Huella actual de la tabla products (texto)."""
+    fila = leer_sql(query_huella_productos).iloc[0]
+    return f"{int(fila['n'])}-{fila['max_id']}-{fila['md5']}"
+
+
+def exportar_catalogo(df, huella=None):
+    """
+    Escribe el DataFrame de products en Parquet asociado a la huella del
+    índice persistido actual y a la de products (`huella`, tomada antes de
+    leer `df`; si no se da, se calcula ahora), para que el siguiente arranque
+    no necesite leer la tabla.
+    """
+    if huella is None:
+        huella = huella_productos()
+    meta_indice = leer_meta_indice() or {}
+    os.makedirs(INDEX_DIR, exist_ok=True)
+
+    tabla = pa.Table.from_pandas(df.sort_values("product_id"), preserve_index=False)
+    tmp = f"{RUTA_CATALOGO}.tmp{os.getpid()}"
+    pq.write_table(tabla, tmp, compression="zstd")
+    os.replace(tmp, RUTA_CATALOGO)
+    guardar_json(RUTA_CATALOGO_META, {
+        "huella": meta_indice.get("huella"),
+        "huella_productos": huella,
+        "n_productos": tabla.num_rows,
+        "creado": datetime.now().isoformat(timespec="seconds"),
+    })
+    print(f"💾 Catálogo exportado a {RUTA_CATALOGO}: {tabla.num_rows} productos")
+
+
+def cargar_catalogo_exportado():
+    """
+    Lee el catálogo Parquet con mmap si corresponde al índice persistido y
+    products no ha cambiado desde la exportación (si PostgreSQL no responde,
+    se arranca con el archivo). Devuelve un DataFrame o None si no existe, está
+    desactualizado o el índice se construyó con otra configuración
+    (ANNOY_N_TREES, FEATURES_DTYPE): así el arranque pasa por
+    cargar_o_construir_indice y lo reconstruye.
+    """
+    meta = leer_json(RUTA_CATALOGO_META)
+    meta_indice = leer_meta_indice()
+    if not meta or not meta_indice:
+        return None
+    if not meta_compatible(meta_indice):
+        print("⚠️ El índice persistido se construyó con otra configuración; se reconstruirá desde PostgreSQL")
+        return None
+    if not meta.get("huella") or meta.get("huella") != meta_indice.get("huella"):
+        print("⚠️ El catálogo exportado no corresponde al índice actual; se leerá de PostgreSQL")
+        return None
+    try:
+        if huella_productos() != meta.get("huella_productos"):
+            print("⚠️ products ha cambiado desde la exportación; se leerá de PostgreSQL")
+            return None
+    except Exception as e:
+        print("⚠️ No se pudo comprobar la huella de products; se usa el catálogo exportado:", e)
+
+    try:
+        # Las columnas numéricas se comparten con el mapeo; solo las de texto se materializan
+        tabla = pq.read_table(RUTA_CATALOGO, memory_map=True)
+        df = tabla.to_pandas(split_blocks=True, self_destruct=True)
+        print(f"✅ Catálogo cargado desde {RUTA_CATALOGO}: {len(df)} productos (creado {meta.get('creado')})")
+        return df
+    except Exception as e:
+        print("⚠️ No se pudo leer el catálogo exportado:", e)
+        return None
+
+
+__all__ = ["huella_productos", "exportar_catalogo", "cargar_catalogo_exportado"]
@@ -0,0 +1,31 @@
+import os
+import json
+import numpy as np
+
+# Escritura atómica de artefactos: se escribe en un temporal y se renombra,
+# así otros procesos nunca leen un fichero a medias.
+
+
+def leer_json(ruta):
+    try:
+        with open(ruta, encoding="utf-8") as f:
+            return json.load(f)
+    except Exception:
+        return None
+
+
+def guardar_array(ruta, array):
+    tmp = f"{ruta}.tmp{os.getpid()}"
+    with open(tmp, "wb") as f:
+        np.save(f, array)
+    os.replace(tmp, ruta)
+
+
+def guardar_json(ruta, datos):
+    tmp = f"{ruta}.tmp{os.getpid()}"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(datos, f, ensure_ascii=False, indent=2)
+    os.replace(tmp, ruta)
+
+
+__all__ = ["leer_json", "guardar_array", "guardar_json"]
@@ -0,0 +1,171 @@
+import numpy as np
+import pandas as pd
+
+from app.db import engine
+from app.catalogo import internar
+
+# Columnas de products sobre las que se puede filtrar
+COLUMNAS_FILTRO = [
+    "gender", "mastercategory", "subcategory",
+    "articletype", "basecolour", "season", "year", "usage"
+]
+
+# Valores por columna que se incluyen en el contexto para el LLM
+MAX_VALORES_CONTEXTO = 100
+
+query_atributos = f"""
+SELECT id AS product_id, productdisplayname, image_url, {", ".join(COLUMNAS_FILTRO)}
+FROM products
+ORDER BY id
+"""
+
+# Filas añadidas a products después de construir un índice (delta)
+query_atributos_nuevos = f"""
+SELECT id AS product_id, productdisplayname, image_url, {", ".join(COLUMNAS_FILTRO)}
+FROM products
+WHERE id > %(max_id)s
+ORDER BY id
+"""
+
+
+def clave_valor(valor):
+    """
+    Valor de filtro normalizado como texto, igual que lo compara PostgreSQL
+    con `col = 'valor'` (2012, 2012.0 y '2012' son el mismo año).
+    """
+    if valor is None or (isinstance(valor, float) and np.isnan(valor)):
+        return None
+    if isinstance(valor, float) and valor.is_integer():
+        return str(int(valor))
+    return str(valor)
+
+
+def valores_filtro(valor):
+    """Un filtro puede ser un valor (`col = v`) o una lista (`col IN (...)`)."""
+    return list(valor) if isinstance(valor, (list, tuple, set)) else [valor]
+
+
+class IndiceAtributos:
+    """
+    Índice invertido de products: un bitmap empaquetado por cada valor de las
+    columnas filtrables. Un filtro {col: valor | [valores]} se resuelve con OR
+    dentro de cada columna y AND entre columnas, como la WHERE de
+    construir_where_clause.
+
+    Con `base`, el índice es el de `base` más las filas de `df` añadidas al
+    final: solo se factorizan las filas nuevas y los bitmaps existentes se
+    amplían en memoria, sin volver a leer products.
+    """
+
+    def __init__(self, df, base=None):
+        n_base = base.n if base is not None else 0
+        self.n = n_base + len(df)
+        self.ids = df["product_id"].to_numpy(dtype=np.int64)
+        self.nombres = internar(df["productdisplayname"].tolist())
+        self.imagenes = internar(df["image_url"].tolist())
+        if base is not None:
+            self.ids = np.concatenate([base.ids, self.ids])
+            self.nombres = np.concatenate([base.nombres, self.nombres])
+            self.imagenes = np.concatenate([base.imagenes, self.imagenes])
+
+        self._vacio = np.zeros((self.n + 7) // 8, dtype=np.uint8)
+        self._todos = np.packbits(np.ones(self.n, dtype=bool))
+
+        self.bitmaps = {}
+        for col in COLUMNAS_FILTRO:
+            claves = pd.Series([clave_valor(v) for v in df[col]] if col in df else [None] * len(df), dtype=object)
+            codigos, valores = pd.factorize(claves)
+            nuevos = {valor: codigos == k for k, valor in enumerate(valores)}
+            if base is None:
+                self.bitmaps[col] = {valor: np.packbits(bits) for valor, bits in nuevos.items()}
+                continue
+            anteriores = base.bitmaps.get(col, {})
+            self.bitmaps[col] = {
+                valor: np.packbits(np.concatenate([
+                    np.unpackbits(anteriores[valor], count=n_base) if valor in anteriores else np.zeros(n_base, dtype=np.uint8),
+                    nuevos.get(valor, np.zeros(len(df), dtype=bool))
+                ]))
+                for valor in set(anteriores) | set(nuevos)
+            }
+
+        # Vocabulario del catálogo: se calcula una vez por versión del índice
+        self.vocabulario = {
+            col: sorted(v for v in self.bitmaps[col] if v is not None)
+            for col in COLUMNAS_FILTRO
+        }
+        self.contexto_columnas = "\n".join(
+            f"{col}: {', '.join(valores[:MAX_VALORES_CONTEXTO])}"
+            for col, valores in self.vocabulario.items()
+        )
+
+    def valores(self, col):
+        """Valores existentes de una columna."""
+        return list(self.bitmaps.get(col, {}).keys())
+
+    def bitmap(self, filtros):
+        """Bitmap empaquetado de las filas que cumplen todos los filtros."""
+        resultado = self._todos.copy()
+        for col, val in filtros.items():
+            por_valor = self.bitmaps.get(col)
+            if por_valor is None:
+                # Columna no filtrable: en SQL la consulta fallaría y no habría resultados
+                return self._vacio.copy()
+            union = self._vacio.copy()
+            for v in valores_filtro(val):
+                bm = por_valor.get(clave_valor(v))
+                if bm is not None:
+                    np.bitwise_or(union, bm, out=union)
+            np.bitwise_and(resultado, union, out=resultado)
+        return resultado
+
+    def mascara(self, filtros):
+        """Array booleano de filas que cumplen los filtros."""
+        return np.unpackbits(self.bitmap(filtros), count=self.n).astype(bool)
+
+    def contar(self, filtros):
+        """Número exacto de productos que cumplen los filtros."""
+        return int(np.count_nonzero(self.mascara(filtros)))
+
+    def ids_filtrados(self, filtros):
+        return self.ids[self.mascara(filtros)]
+
+    def buscar(self, filtros, limit=None):
+        """DataFrame (product_id, productdisplayname, image_url) de los productos que cumplen los filtros."""
+        filas = np.flatnonzero(self.mascara(filtros))[:limit]
+        return pd.DataFrame({
+            "product_id": self.ids[filas],
+            "productdisplayname": self.nombres[filas],
+            "image_url": self.imagenes[filas]
+        })
+
+
+def leer_atributos():
+    """Columnas de presentación y filtrables de products (vacío si falla la consulta)."""
+    try:
+        return pd.read_sql_query(query_atributos, engine)
+    except Exception as e:
+        print("❌ Error al cargar atributos de productos:", e)
+        return pd.DataFrame(columns=["product_id", "productdisplayname", "image_url"] + COLUMNAS_FILTRO)
+
+
+def leer_atributos_nuevos(max_id):
+    """Filas de products con id > max_id (vacío si falla la consulta)."""
+    try:
+        return pd.read_sql_query(query_atributos_nuevos, engine, params={"max_id": int(max_id)})
+    except Exception as e:
+        print("❌ Error al cargar atributos de productos nuevos:", e)
+        return pd.DataFrame(columns=["product_id", "productdisplayname", "image_url"] + COLUMNAS_FILTRO)
+
+
+def cargar_indice_atributos(df=None):
+    """Construye el índice a partir de `df` o, si no se da, de products."""
+    if df is None:
+        df = leer_atributos()
+
+    indice = IndiceAtributos(df)
+    n_bitmaps = sum(len(v) for v in indice.bitmaps.values())
+    print(f"✅ Índice de atributos construido: {indice.n} productos, {n_bitmaps} valores")
+    return indice
+
+
+__all__ = ["COLUMNAS_FILTRO", "MAX_VALORES_CONTEXTO", "IndiceAtributos", "leer_atributos", "leer_atributos_nuevos", "cargar_indice_atributos", "clave_valor", "valores_filtro"]
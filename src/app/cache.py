@@ -0,0 +1,83 @@
+import time
+import threading
+from collections import OrderedDict
+
+from app.atributos import clave_valor, valores_filtro
+
+
+def clave_filtros(filtros):
+    """
+    Forma canónica de un dict de filtros: columnas ordenadas y valores como
+    texto ordenado, así {"a": ["y", "x"]} y {"a": ["x", "y"]} son la misma búsqueda.
+    """
+    return tuple(
+        (col, tuple(sorted({str(clave_valor(v)) for v in valores_filtro(filtros[col])})))
+        for col in sorted(filtros)
+    )
+
+
+class CacheLRU:
+    """
+    Caché acotada en número de entradas (se expulsa la menos usada) y en
+    tiempo (`ttl` segundos). Lleva la cuenta de aciertos y fallos.
+
+    Cada entrada pertenece a una versión del catálogo: al pedir una clave de
+    otra versión se vacía entera.
+    """
+
+    def __init__(self, max_items, ttl):
+        self.max_items = max_items
+        self.ttl = ttl
+        self.version = None
+        self._datos = OrderedDict()
+        self._lock = threading.Lock()
+        self.aciertos = 0
+        self.fallos = 0
+        self.invalidaciones = 0
+
+    def __len__(self):
+        return len(self._datos)
+
+    def _comprobar_version(self, version):
+        if version != self.version:
+            if self._datos:
+                self.invalidaciones += 1
+            self._datos.clear()
+            self.version = version
+
+    def obtener(self, version, clave):
+        """Valor guardado o None si no está, ha caducado o es de otra versión."""
+        with self._lock:
+            self._comprobar_version(version)
+            entrada = self._datos.get(clave)
+            if entrada is not None and time.monotonic() - entrada[0] <= self.ttl:
+                self._datos.move_to_end(clave)
+                self.aciertos += 1
+                return entrada[1]
+            if entrada is not None:
+                del self._datos[clave]
+            self.fallos += 1
+            return None
+
+    def guardar(self, version, clave, valor):
+        if self.max_items <= 0:
+            return
+        with self._lock:
+            self._comprobar_version(version)
+            self._datos[clave] = (time.monotonic(), valor)
+            self._datos.move_to_end(clave)
+            while len(self._datos) > self.max_items:
+                self._datos.popitem(last=False)
+
+    def tasa_aciertos(self):
+        total = self.aciertos + self.fallos
+        return self.aciertos / total if total else 0.0
+
+    def descripcion(self):
+        return (
+            f"{len(self)}/{self.max_items} entradas, {self.tasa_aciertos():.0%} aciertos "
+            f"({self.aciertos} de {self.aciertos + self.fallos}), {self.invalidaciones} invalidaciones"
+        )
+
+
+__all__ = ["CacheLRU", "clave_filtros"]
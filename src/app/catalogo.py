@@ -0,0 +1,123 @@
+import sys
+import numpy as np
+import pandas as pd
+
+# Como mucho este factor de huecos entre ids para usar una tabla directa product_id -> posición
+MAX_DENSIDAD_TABLA = 4
+
+
+def internar(valores):
+    """Array de objetos con cadenas internadas: los valores repetidos comparten memoria."""
+    return np.array(
+        [sys.intern(v) if isinstance(v, str) else None for v in valores],
+        dtype=object
+    )
+
+
+class CatalogoProductos:
+    """
+    Catálogo de productos en columnas, indexado por product_id.
+
+    La posición de un producto es la misma en todas las columnas y coincide
+    con el id del item en el índice de similitud. Las búsquedas por
+    product_id son O(1) y devuelven solo los campos de presentación.
+    """
+
+    def __init__(self, ids, nombres, imagenes, features=None):
+        self.ids = np.asarray(ids, dtype=np.int64)
+        self.nombres = internar(nombres)
+        self.imagenes = internar(imagenes)
+        self.features = features
+        self._tabla = None
+        self._orden = None
+        self._ids_ordenados = None
+
+        if len(self.ids) == 0:
+            return
+
+        max_id = int(self.ids.max())
+        if self.ids.min() >= 0 and max_id < MAX_DENSIDAD_TABLA * len(self.ids) + 1024:
+            # Tabla directa: posicion = _tabla[product_id], -1 si no existe
+            self._tabla = np.full(max_id + 1, -1, dtype=np.int32)
+            self._tabla[self.ids] = np.arange(len(self.ids), dtype=np.int32)
+        else:
+            # Ids muy dispersos: búsqueda binaria sobre los ids ordenados
+            self._orden = np.argsort(self.ids, kind="stable").astype(np.int32)
+            self._ids_ordenados = self.ids[self._orden]
+
+    @classmethod
+    def desde_dataframe(cls, df, features=None):
+        return cls(
+            df["product_id"].to_numpy(dtype=np.int64),
+            df["productdisplayname"].tolist(),
+            df["image_url"].tolist(),
+            features=features
+        )
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __contains__(self, product_id):
+        return self.posicion(product_id) is not None
+
+    def posicion(self, product_id):
+        """Posición del producto en el catálogo o None si no existe."""
+        try:
+            pid = int(product_id)
+        except (TypeError, ValueError):
+            return None
+
+        if self._tabla is not None:
+            if 0 <= pid < len(self._tabla):
+                pos = int(self._tabla[pid])
+                return pos if pos >= 0 else None
+            return None
+
+        if self._orden is not None:
+            k = int(np.searchsorted(self._ids_ordenados, pid))
+            if k < len(self._ids_ordenados) and self._ids_ordenados[k] == pid:
+                return int(self._orden[k])
+        return None
+
+    def posiciones(self, product_ids):
+        """Versión vectorizada de posicion(): array int64 con -1 para los ids que no existen."""
+        pids = np.asarray(product_ids, dtype=np.int64)
+        resultado = np.full(len(pids), -1, dtype=np.int64)
+        if len(self.ids) == 0 or len(pids) == 0:
+            return resultado
+
+        if self._tabla is not None:
+            validos = (pids >= 0) & (pids < len(self._tabla))
+            resultado[validos] = self._tabla[pids[validos]]
+        else:
+            k = np.searchsorted(self._ids_ordenados, pids)
+            k_valido = np.minimum(k, len(self._ids_ordenados) - 1)
+            encontrados = self._ids_ordenados[k_valido] == pids
+            resultado[encontrados] = self._orden[k_valido[encontrados]]
+        return resultado
+
+    def producto(self, pos):
+        """Campos de presentación del producto en la posición `pos`."""
+        return {
+            "product_id": int(self.ids[pos]),
+            "productdisplayname": self.nombres[pos],
+            "image_url": self.imagenes[pos]
+        }
+
+    def obtener(self, product_id):
+        """Campos de presentación del producto o None si no existe."""
+        pos = self.posicion(product_id)
+        return self.producto(pos) if pos is not None else None
+
+    def a_dataframe(self, posiciones=None):
+        """DataFrame con los campos de presentación (todas las filas o las posiciones dadas)."""
+        if posiciones is None:
+            posiciones = slice(None)
+        return pd.DataFrame({
+            "product_id": self.ids[posiciones],
+            "productdisplayname": self.nombres[posiciones],
+            "image_url": self.imagenes[posiciones]
+        })
+
+
+__all__ = ["CatalogoProductos", "internar"]
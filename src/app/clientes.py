@@ -0,0 +1,99 @@
+import threading
+
+import numpy as np
+import pandas as pd
+
+from app.db import engine
+from app.catalogo import internar
+from app.cache import CacheLRU
+from app.consultas import consulta_nombre_cliente
+from app.config import FEATURES_CHUNKSIZE, CLIENTES_CACHE_MAX, CLIENTES_CACHE_TTL_S
+
+query_clientes = """
+SELECT customer_id, first_name, last_name
+FROM customers
+ORDER BY customer_id
+"""
+
+# Marca en la caché de "este cliente no existe" (caché negativa)
+_DESCONOCIDO = ""
+
+
+def _nombre_completo(nombre, apellido):
+    return f"{nombre} {apellido}"
+
+
+class DirectorioClientes:
+    """
+    Nombre de cada cliente por customer_id, en memoria: ids ordenados (int64)
+    y nombres internados, cargados de una vez y renovados en segundo plano.
+
+    Los clientes dados de alta después de la última carga se consultan uno a
+    uno y el resultado, también "no existe", se guarda en una caché LRU.
+    """
+
+    def __init__(self, max_cache=CLIENTES_CACHE_MAX, ttl_cache=CLIENTES_CACHE_TTL_S):
+        self._datos = (np.empty(0, dtype=np.int64), internar([]))
+        self._version = 0
+        self._lock_recarga = threading.Lock()
+        self.cache = CacheLRU(max_cache, ttl_cache)
+
+    def __len__(self):
+        return len(self._datos[0])
+
+    def _en_memoria(self, customer_id):
+        ids, nombres = self._datos
+        k = int(np.searchsorted(ids, customer_id))
+        if k < len(ids) and ids[k] == customer_id:
+            return nombres[k]
+        return None
+
+    def nombre(self, customer_id):
+        """Nombre completo del cliente o None si no existe."""
+        customer_id = int(customer_id)
+        nombre = self._en_memoria(customer_id)
+        if nombre is not None:
+            return nombre
+
+        version = self._version
+        nombre = self.cache.obtener(version, customer_id)
+        if nombre is None:
+            try:
+                df = consulta_nombre_cliente.ejecutar(customer_id)
+            except Exception as e:
+                # Un fallo de la consulta no se guarda como cliente desconocido
+                print("❌ Error al buscar cliente:", e)
+                return None
+            nombre = _nombre_completo(df.iloc[0]["first_name"], df.iloc[0]["last_name"]) if not df.empty else _DESCONOCIDO
+            self.cache.guardar(version, customer_id, nombre)
+        return nombre or None
+
+    def recargar(self, chunksize=FEATURES_CHUNKSIZE):
+        """Carga todos los clientes y sustituye el directorio de una vez."""
+        if not self._lock_recarga.acquire(blocking=False):
+            return False
+        try:
+            ids, nombres = [], []
+            with engine.connect().execution_options(stream_results=True) as conn:
+                for bloque in pd.read_sql_query(query_clientes, conn, chunksize=chunksize):
+                    ids.append(bloque["customer_id"].to_numpy(dtype=np.int64))
+                    nombres.extend(map(_nombre_completo, bloque["first_name"], bloque["last_name"]))
+            nuevos_ids = np.concatenate(ids) if ids else np.empty(0, dtype=np.int64)
+            nuevos_nombres = internar(nombres)
+
+            # Asignación única: los lectores ven el directorio anterior o el nuevo completo
+            self._datos = (nuevos_ids, nuevos_nombres)
+            self._version += 1
+            print(f"✅ Directorio de clientes cargado: {len(nuevos_ids)} clientes")
+            return True
+        except Exception as e:
+            print("❌ Error cargando el directorio de clientes; se mantiene el actual:", e)
+            return False
+        finally:
+            self._lock_recarga.release()
+
+
+directorio_clientes = DirectorioClientes()
+
+
+__all__ = ["DirectorioClientes", "directorio_clientes"]
@@ -15,6 +15,66 @@ DB_NAME = os.getenv("DB_NAME")
 DB_USER = os.getenv("DB_USER")
 DB_PASSWORD = os.getenv("DB_PASSWORD")
 
+# Pool de conexiones: conexiones fijas, extra en picos, reciclado (s) y espera máxima al conectar (s)
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "5"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+DB_CONNECT_TIMEOUT = int(os.getenv("DB_CONNECT_TIMEOUT", "10"))
+
+# Artefactos del recomendador (índice Annoy persistido en disco)
+INDEX_DIR = os.getenv("INDEX_DIR", "artefactos")
+ANNOY_N_TREES = int(os.getenv("ANNOY_N_TREES", "10"))
+FEATURES_CHUNKSIZE = int(os.getenv("FEATURES_CHUNKSIZE", "20000"))
+FEATURES_DTYPE = os.getenv("FEATURES_DTYPE", "float32")  # float32, float16 o int8
+VECINOS_K = int(os.getenv("VECINOS_K", "50"))
+
+# Motor de similitud: "annoy" (aproximado) o "exacto" (coseno con NumPy/BLAS)
+SIMILARITY_BACKEND = os.getenv("SIMILARITY_BACKEND", "annoy")
+ANNOY_SEARCH_K = int(os.getenv("ANNOY_SEARCH_K", "-1"))
+
+# Productos nuevos fuera del índice: cada cuánto se buscan y a partir de cuántos se reconstruye
+DELTA_INTERVALO_S = int(os.getenv("DELTA_INTERVALO_S", "60"))
+DELTA_MAX_ITEMS = int(os.getenv("DELTA_MAX_ITEMS", "1000"))
+
+# Caché de resultados de búsqueda por filtros: entradas máximas y caducidad (s)
+CACHE_BUSQUEDAS_MAX = int(os.getenv("CACHE_BUSQUEDAS_MAX", "1024"))
+CACHE_BUSQUEDAS_TTL_S = int(os.getenv("CACHE_BUSQUEDAS_TTL_S", "600"))
+
+# Directorio de clientes: cada cuánto se recarga (s) y caché de clientes nuevos o inexistentes
+CLIENTES_INTERVALO_S = int(os.getenv("CLIENTES_INTERVALO_S", "3600"))
+CLIENTES_CACHE_MAX = int(os.getenv("CLIENTES_CACHE_MAX", "10000"))
+CLIENTES_CACHE_TTL_S = int(os.getenv("CLIENTES_CACHE_TTL_S", "300"))
+
+# Segundos máximos para generar con el LLM los textos de una galería
+PLAZO_DESCRIPCIONES_S = float(os.getenv("PLAZO_DESCRIPCIONES_S", "8"))
+
+# Respuestas del LLM en streaming: segundos mínimos entre ediciones del mensaje de Telegram
+STREAMING_INTERVALO_S = float(os.getenv("STREAMING_INTERVALO_S", "1.0"))
+
+# Descripciones de productos generadas por el LLM que se mantienen en memoria
+DESCRIPCIONES_CACHE_MAX = int(os.getenv("DESCRIPCIONES_CACHE_MAX", "5000"))
+
+# Enrutado local de intenciones: probabilidad mínima del clasificador y palabras máximas del mensaje
+ROUTER_UMBRAL = float(os.getenv("ROUTER_UMBRAL", "0.85"))
+ROUTER_MAX_PALABRAS = int(os.getenv("ROUTER_MAX_PALABRAS", "8"))
+
+# Corrección local de filtros: similitud mínima (difflib) para proponer un valor parecido del catálogo
+# y confianza mínima para aceptar una corrección sin consultar al LLM
+NORMALIZADOR_UMBRAL = float(os.getenv("NORMALIZADOR_UMBRAL", "0.8"))
+NORMALIZADOR_CONFIANZA_MIN = float(os.getenv("NORMALIZADOR_CONFIANZA_MIN", "0.9"))
+
+# Latencia del LLM: plazo de cada petición a OpenAI y reintentos, presupuesto total por
+# mensaje, plazo máximo de cada paso y circuito (fallos seguidos para abrirlo y segundos abierto)
+LLM_TIMEOUT_S = float(os.getenv("LLM_TIMEOUT_S", "20"))
+LLM_MAX_REINTENTOS = int(os.getenv("LLM_MAX_REINTENTOS", "1"))
+PRESUPUESTO_MENSAJE_S = float(os.getenv("PRESUPUESTO_MENSAJE_S", "30"))
+LLM_PLAZO_PASO_S = float(os.getenv("LLM_PLAZO_PASO_S", "12"))
+LLM_CIRCUITO_FALLOS = int(os.getenv("LLM_CIRCUITO_FALLOS", "5"))
+LLM_CIRCUITO_ESPERA_S = float(os.getenv("LLM_CIRCUITO_ESPERA_S", "30"))
+
+# Chats de Telegram con permiso para comandos de administración (/recargar), separados por comas
+ADMIN_CHAT_IDS = {int(cid) for cid in os.getenv("ADMIN_CHAT_IDS", "").split(",") if cid.strip()}
+
 # Validaciones
 assert TELEGRAM_BOT_TOKEN, "⚠️ Falta TELEGRAM_BOT_TOKEN_PRODUCTS_LLM en .env"
 assert OPENAI_API_KEY, "⚠️ Falta TELEGRAM_BOT_TOKEN_PRODUCTS_CHATGPT en .env"
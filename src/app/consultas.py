@@ -0,0 +1,135 @@
+import threading
+
+import pandas as pd
+
+from app.db import engine
+from app.atributos import COLUMNAS_FILTRO, clave_valor, valores_filtro
+
+
+class ConsultaPreparada:
+    """
+    Sentencia con parámetros posicionales ($1, $2, ...) que se prepara con
+    PREPARE la primera vez que se usa en cada conexión del pool y después se
+    ejecuta con EXECUTE, reutilizando el plan de PostgreSQL.
+
+    Los valores nunca se interpolan en el texto SQL: viajan como parámetros.
+    """
+
+    def __init__(self, nombre, sql, tipos):
+        self.nombre = nombre
+        self.sql = sql
+        self.tipos = tipos
+
+    def _preparar(self, conn):
+        # El registro vive en la conexión DBAPI, que el pool reutiliza entre checkouts
+        preparadas = conn.connection.info.setdefault("preparadas", set())
+        if self.nombre not in preparadas:
+            conn.exec_driver_sql(f"PREPARE {self.nombre} ({', '.join(self.tipos)}) AS {self.sql}")
+            preparadas.add(self.nombre)
+
+    def ejecutar(self, *params):
+        """Ejecuta la sentencia y devuelve el resultado como DataFrame."""
+        if len(params) != len(self.tipos):
+            raise ValueError(f"{self.nombre} espera {len(self.tipos)} parámetros y recibió {len(params)}")
+        marcadores = ", ".join(["%s"] * len(params))
+        with engine.connect() as conn:
+            self._preparar(conn)
+            resultado = conn.exec_driver_sql(f"EXECUTE {self.nombre} ({marcadores})", tuple(params))
+            return pd.DataFrame(resultado.fetchall(), columns=list(resultado.keys()))
+
+
+# --- Consultas fijas
+
+consulta_historial_cliente = ConsultaPreparada(
+    "historial_cliente",
+    """
+    SELECT pem.product_id, p.productdisplayname, p.image_url
+    FROM customers c
+    JOIN transactions t ON c.customer_id = t.customer_id
+    JOIN click_stream cs ON t.session_id = cs.session_id
+    JOIN product_event_metadata pem ON cs.event_id = pem.event_id
+    JOIN products p ON pem.product_id = p.id
+    WHERE c.customer_id = $1
+    """,
+    ["bigint"]
+)
+
+consulta_nombre_cliente = ConsultaPreparada(
+    "nombre_cliente",
+    "SELECT first_name, last_name FROM customers WHERE customer_id = $1",
+    ["bigint"]
+)
+
+
+# --- Búsqueda por filtros: una sentencia preparada por combinación de columnas
+
+# Tipo del array enlazado por columna (el de la columna en products; el resto son VARCHAR).
+# La columna no se convierte, así PostgreSQL puede usar sus índices.
+TIPOS_COLUMNA = {"year": "int[]"}
+
+
+def _valor_columna(col, valor):
+    """Valor de filtro convertido al tipo de la columna, o None si no puede coincidir."""
+    clave = clave_valor(valor)
+    if clave is None or TIPOS_COLUMNA.get(col) != "int[]":
+        return clave
+    try:
+        return int(float(clave))
+    except ValueError:
+        return None
+
+
+def construir_where_clause(filtros, primer_parametro=1):
+    """
+    WHERE parametrizada para filtros {col: valor | [valores]}. Cada columna se
+    compara con un array enlazado de su mismo tipo (`col = ANY($n)`), de modo
+    que un valor o una lista usan la misma sentencia.
+
+    Devuelve (where_sql, tipos, valores). Solo se aceptan columnas de
+    COLUMNAS_FILTRO; con cualquier otra no hay resultados.
+    """
+    condiciones, tipos, valores = [], [], []
+    for col in sorted(filtros):
+        if col not in COLUMNAS_FILTRO:
+            return "FALSE", [], []
+        condiciones.append(f"{col} = ANY(${primer_parametro + len(valores)})")
+        tipos.append(TIPOS_COLUMNA.get(col, "text[]"))
+        convertidos = [_valor_columna(col, v) for v in valores_filtro(filtros[col])]
+        valores.append([v for v in convertidos if v is not None])
+    return (" AND ".join(condiciones) if condiciones else "TRUE"), tipos, valores
+
+
+_consultas_busqueda = {}
+_lock_consultas = threading.Lock()
+
+
+def consulta_busqueda_productos(filtros):
+    """Sentencia preparada de búsqueda para las columnas de `filtros` (el último parámetro es el LIMIT)."""
+    where_sql, tipos, valores = construir_where_clause(filtros)
+    columnas = tuple(sorted(filtros)) if where_sql != "FALSE" else ("ninguna",)
+    with _lock_consultas:
+        consulta = _consultas_busqueda.get(columnas)
+        if consulta is None:
+            consulta = ConsultaPreparada(
+                "buscar_productos_" + ("_".join(columnas) or "todos"),
+                f"""
+                SELECT id, productdisplayname, image_url
+                FROM products
+                WHERE {where_sql}
+                LIMIT ${len(tipos) + 1}
+                """,
+                tipos + ["bigint"]
+            )
+            _consultas_busqueda[columnas] = consulta
+    return consulta, valores
+
+
+def buscar_productos_preparada(filtros, limit=10):
+    consulta, valores = consulta_busqueda_productos(filtros)
+    return consulta.ejecutar(*valores, int(limit))
+
+
+__all__ = [
+    "ConsultaPreparada", "consulta_historial_cliente", "consulta_nombre_cliente",
+    "construir_where_clause", "consulta_busqueda_productos", "buscar_productos_preparada"
+]
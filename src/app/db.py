@@ -1,10 +1,40 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
 from sqlalchemy import create_engine
-from sqlalchemy.pool import NullPool
-from app.config import DB_HOST, DB_PORT, DB_NAME, DB_USER, DB_PASSWORD
+from app.config import (
+    DB_HOST, DB_PORT, DB_NAME, DB_USER, DB_PASSWORD,
+    DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_RECYCLE, DB_CONNECT_TIMEOUT
+)
 
-# Crear engine de SQLAlchemy reutilizable
+# Crear engine de SQLAlchemy reutilizable, con un pool de conexiones compartido
 engine = create_engine(
     f"postgresql://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}",
-    poolclass=NullPool,
-    connect_args={"connect_timeout": 120}
-)
\ No newline at end of file
+    pool_size=DB_POOL_SIZE,
+    max_overflow=DB_MAX_OVERFLOW,
+    pool_recycle=DB_POOL_RECYCLE,
+    pool_pre_ping=True,  # descarta conexiones cortadas por el servidor antes de usarlas
+    connect_args={"connect_timeout": DB_CONNECT_TIMEOUT}
+)
+
+# Hilos para las consultas lanzadas desde los manejadores async: tantos como
+# conexiones puede dar el pool, así ningún hilo se queda esperando una conexión
+executor_bd = ThreadPoolExecutor(max_workers=DB_POOL_SIZE + DB_MAX_OVERFLOW, thread_name_prefix="bd")
+
+
+def leer_sql(query, params=None):
+    """pd.read_sql_query sobre el engine compartido."""
+    return pd.read_sql_query(query, engine, params=params)
+
+
+async def en_hilo_bd(funcion, *args, **kwargs):
+    """
+    Ejecuta una función bloqueante de acceso a datos en el executor de la base
+    de datos, sin parar el bucle de eventos mientras espera a PostgreSQL.
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(executor_bd, lambda: funcion(*args, **kwargs))
+
+
+__all__ = ["engine", "executor_bd", "leer_sql", "en_hilo_bd"]
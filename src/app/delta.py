@@ -0,0 +1,71 @@
+import numpy as np
+import pandas as pd
+from sqlalchemy import text
+
+from app.db import engine
+from app.indice import normalizar_filas
+from app.similitud import mejores_similitudes
+
+# Productos añadidos después de la última construcción completa del índice.
+# Se asume que los product_id nuevos son mayores que los ya indexados.
+query_delta = text("""
+SELECT pf.*, p.productdisplayname, p.image_url
+FROM public.product_features_encoded pf
+LEFT JOIN products p ON p.id = pf.product_id
+WHERE pf.product_id > :max_id
+ORDER BY pf.product_id
+""")
+
+
+class DeltaProductos:
+    """
+    Búfer de búsqueda exacta para los productos que aún no están en el índice
+    principal. Ocupan en el catálogo las posiciones [inicio, inicio + len).
+    """
+
+    def __init__(self, inicio, ids, matriz):
+        self.inicio = inicio
+        self.ids = np.asarray(ids, dtype=np.int64)
+        self.matriz = matriz
+
+    def __len__(self):
+        return len(self.ids)
+
+    def contiene(self, pos):
+        return self.inicio <= pos < self.inicio + len(self)
+
+    def vector(self, pos):
+        return self.matriz[pos - self.inicio]
+
+    def vecinos(self, vector, n, permitidos=None, excluir=None):
+        """Hasta n (posicion, similitud) del delta respecto a un vector normalizado."""
+        if len(self) == 0:
+            return []
+        sims = self.matriz @ np.asarray(vector, dtype=np.float32).ravel()
+        posiciones = np.arange(self.inicio, self.inicio + len(self))
+        validos = np.ones(len(self), dtype=bool)
+        if permitidos is not None:
+            validos &= permitidos[self.inicio:self.inicio + len(self)]
+        if excluir is not None and self.contiene(excluir):
+            validos[excluir - self.inicio] = False
+        return mejores_similitudes(sims[validos], posiciones[validos], n)
+
+
+def fusionar_vecinos(a, b, n):
+    """Mezcla dos listas de (posicion, similitud) y se queda con las n mejores."""
+    return sorted(a + b, key=lambda v: v[1], reverse=True)[:n]
+
+
+def cargar_productos_nuevos(max_id, feature_cols):
+    """
+    Lee de product_features_encoded los productos con product_id > max_id.
+    Devuelve (df_presentacion, matriz normalizada float32).
+    """
+    df = pd.read_sql_query(query_delta, engine, params={"max_id": int(max_id)})
+    df = df.drop_duplicates(subset="product_id").reset_index(drop=True)
+    matriz = df.reindex(columns=feature_cols).to_numpy(dtype=np.float32, na_value=0.0)
+    normalizar_filas(matriz)
+    return df[["product_id", "productdisplayname", "image_url"]], matriz
+
+
+__all__ = ["DeltaProductos", "fusionar_vecinos", "cargar_productos_nuevos"]
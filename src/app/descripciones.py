@@ -0,0 +1,161 @@
+import os
+import hashlib
+import sqlite3
+import threading
+from datetime import datetime
+
+from app.config import INDEX_DIR, DESCRIPCIONES_CACHE_MAX
+from app.cache import CacheLRU
+from app.responses import (
+    llm,
+    prompt_descripcion_producto,
+    chain_descripcion_producto,
+    prompt_ampliar_info_producto,
+    chain_ampliar_info_producto
+)
+from app.utils import generar_textos_llm, transmitir_texto_llm
+
+# Descripciones generadas por el LLM, persistidas en SQLite junto a los demás artefactos
+RUTA_DESCRIPCIONES = os.path.join(INDEX_DIR, "descripciones.sqlite")
+
+
+def _version_prompt(prompt):
+    """Cambia si cambia el texto del prompt o el modelo: las descripciones antiguas dejan de usarse."""
+    modelo = getattr(llm, "model_name", "")
+    return hashlib.md5(f"{modelo}\n{prompt.template}".encode("utf-8")).hexdigest()[:12]
+
+
+# Tipos de descripción: chain que la genera y versión de su prompt
+TIPOS_DESCRIPCION = {
+    "breve": (chain_descripcion_producto, _version_prompt(prompt_descripcion_producto)),
+    "ampliada": (chain_ampliar_info_producto, _version_prompt(prompt_ampliar_info_producto)),
+}
+
+
+class AlmacenDescripciones:
+    """
+    Textos por (tipo, versión del prompt, product_id, variante). La variante
+    recoge lo que además del producto cambia el texto (p. ej. si el cliente
+    está identificado). Delante de SQLite hay una caché LRU en memoria.
+    """
+
+    def __init__(self, ruta=RUTA_DESCRIPCIONES, max_memoria=DESCRIPCIONES_CACHE_MAX):
+        self.ruta = ruta
+        self.memoria = CacheLRU(max_memoria, float("inf"))
+        self._lock = threading.Lock()
+        self._conexion = None
+
+    def _conectar(self):
+        if self._conexion is None:
+            os.makedirs(os.path.dirname(self.ruta) or ".", exist_ok=True)
+            conexion = sqlite3.connect(self.ruta, check_same_thread=False)
+            # WAL: el bot lee mientras tareas.py escribe desde otro proceso
+            conexion.execute("PRAGMA journal_mode=WAL")
+            conexion.execute("""
+                CREATE TABLE IF NOT EXISTS descripciones (
+                    tipo TEXT, version TEXT, product_id INTEGER, variante TEXT,
+                    texto TEXT NOT NULL, creado TEXT,
+                    PRIMARY KEY (tipo, version, product_id, variante)
+                )
+            """)
+            self._conexion = conexion
+        return self._conexion
+
+    def obtener(self, tipo, product_id, variante=""):
+        clave = (tipo, TIPOS_DESCRIPCION[tipo][1], int(product_id), variante)
+        texto = self.memoria.obtener(0, clave)
+        if texto is not None:
+            return texto
+        try:
+            with self._lock:
+                fila = self._conectar().execute(
+                    "SELECT texto FROM descripciones WHERE tipo = ? AND version = ? AND product_id = ? AND variante = ?",
+                    clave
+                ).fetchone()
+        except sqlite3.Error as e:
+            print("⚠️ Error leyendo descripciones:", e)
+            return None
+        if fila is None:
+            return None
+        self.memoria.guardar(0, clave, fila[0])
+        return fila[0]
+
+    def guardar(self, tipo, textos, variante=""):
+        """Guarda {product_id: texto} de un tipo y variante."""
+        version = TIPOS_DESCRIPCION[tipo][1]
+        creado = datetime.now().isoformat(timespec="seconds")
+        filas = [(tipo, version, int(pid), variante, texto, creado) for pid, texto in textos.items()]
+        try:
+            with self._lock:
+                conexion = self._conectar()
+                conexion.executemany("INSERT OR REPLACE INTO descripciones VALUES (?, ?, ?, ?, ?, ?)", filas)
+                conexion.commit()
+        except sqlite3.Error as e:
+            print("⚠️ Error guardando descripciones:", e)
+            return
+        for tipo_, version_, pid, variante_, texto, _ in filas:
+            self.memoria.guardar(0, (tipo_, version_, pid, variante_), texto)
+
+    def pendientes(self, tipo, product_ids, variante=""):
+        """Los product_ids que aún no tienen descripción de este tipo y variante."""
+        version = TIPOS_DESCRIPCION[tipo][1]
+        with self._lock:
+            existentes = {
+                fila[0] for fila in self._conectar().execute(
+                    "SELECT product_id FROM descripciones WHERE tipo = ? AND version = ? AND variante = ?",
+                    (tipo, version, variante)
+                )
+            }
+        return [pid for pid in product_ids if int(pid) not in existentes]
+
+
+almacen_descripciones = AlmacenDescripciones()
+
+
+async def describir_productos(tipo, productos, texto_por_defecto, variante="", plazo=None):
+    """
+    Textos del tipo dado para una lista de (product_id, entrada del prompt).
+    Los que ya están en el almacén no llaman al LLM; el resto se generan a la
+    vez con generar_textos_llm y se guardan. Los fallidos usan `texto_por_defecto`
+    y no se guardan.
+    """
+    textos = [almacen_descripciones.obtener(tipo, pid, variante) for pid, _ in productos]
+    faltan = [i for i, texto in enumerate(textos) if texto is None]
+    if not faltan:
+        return textos
+
+    chain = TIPOS_DESCRIPCION[tipo][0]
+    argumentos = {"plazo": plazo} if plazo is not None else {}
+    generados = await generar_textos_llm(chain, [productos[i][1] for i in faltan], None, **argumentos)
+
+    nuevos = {}
+    for i, texto in zip(faltan, generados):
+        textos[i] = texto or texto_por_defecto
+        if texto:
+            nuevos[productos[i][0]] = texto
+    if nuevos:
+        almacen_descripciones.guardar(tipo, nuevos, variante)
+    return textos
+
+
+async def describir_producto_en_streaming(tipo, product_id, entrada, mostrar, texto_por_defecto, variante="",
+                                         mostrar_final=None, si_falla=None):
+    """
+    Genera la descripción de un producto mostrándola con `mostrar` a medida
+    que llega (ver transmitir_texto_llm) y la guarda solo si el stream terminó
+    bien: un fragmento cortado se muestra pero no se guarda. Quien llama
+    comprueba antes el almacén: este camino es solo para las que faltan.
+    """
+    texto, completo = await transmitir_texto_llm(
+        TIPOS_DESCRIPCION[tipo][0], entrada, mostrar, texto_por_defecto,
+        mostrar_final=mostrar_final, si_falla=si_falla
+    )
+    if texto and completo:
+        almacen_descripciones.guardar(tipo, {product_id: texto}, variante)
+    return texto or texto_por_defecto
+
+
+__all__ = [
+    "TIPOS_DESCRIPCION", "AlmacenDescripciones", "almacen_descripciones",
+    "describir_productos", "describir_producto_en_streaming"
+]
@@ -0,0 +1,136 @@
+import os
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from app.db import engine
+from app.config import INDEX_DIR, FEATURES_CHUNKSIZE
+from app.artefactos import leer_json, guardar_array, guardar_json
+
+# Historial por cliente en formato CSR: los productos del cliente clientes[i]
+# son productos[indptr[i]:indptr[i + 1]]
+RUTA_HISTORIAL_CLIENTES = os.path.join(INDEX_DIR, "historial_clientes.npy")
+RUTA_HISTORIAL_INDPTR = os.path.join(INDEX_DIR, "historial_indptr.npy")
+RUTA_HISTORIAL_PRODUCTOS = os.path.join(INDEX_DIR, "historial_productos.npy")
+RUTA_HISTORIAL_META = os.path.join(INDEX_DIR, "historial_meta.json")
+
+# Productos distintos comprados o vistos por cada cliente (mismo recorrido que la consulta en vivo)
+query_historial = """
+SELECT DISTINCT t.customer_id, pem.product_id
+FROM transactions t
+JOIN click_stream cs ON t.session_id = cs.session_id
+JOIN product_event_metadata pem ON cs.event_id = pem.event_id
+JOIN products p ON pem.product_id = p.id
+ORDER BY t.customer_id, pem.product_id
+"""
+
+# Último cliente existente al calcular el historial: los posteriores no están cubiertos
+query_max_cliente = "SELECT MAX(customer_id) AS max_customer_id FROM customers"
+
+
+class HistorialClientes:
+    """
+    Productos comprados o visualizados por cada cliente. `clientes` está
+    ordenado, así que localizar a un cliente es una búsqueda binaria y su
+    historial es un slice, sin tocar click_stream.
+
+    `max_customer_id` es el mayor cliente que existía al calcularlo: un
+    cliente hasta ese id que no aparece no tiene historial; uno posterior se
+    consulta en vivo. None si no se conoce (todos se consultan en vivo).
+    """
+
+    def __init__(self, clientes, indptr, productos, max_customer_id=None):
+        self.clientes = clientes
+        self.indptr = indptr
+        self.productos = productos
+        self.max_customer_id = max_customer_id
+
+    def __len__(self):
+        return len(self.clientes)
+
+    def productos_de(self, customer_id):
+        """Array de product_id del cliente (vacío si no tiene historial)."""
+        k = int(np.searchsorted(self.clientes, customer_id))
+        if k >= len(self.clientes) or self.clientes[k] != customer_id:
+            return self.productos[:0]
+        return self.productos[self.indptr[k]:self.indptr[k + 1]]
+
+    def __contains__(self, customer_id):
+        return len(self.productos_de(customer_id)) > 0
+
+    def cubre(self, customer_id):
+        """True si el cliente ya existía al calcular el historial."""
+        return self.max_customer_id is not None and customer_id <= self.max_customer_id
+
+    def producto_aleatorio(self, customer_id, rng=np.random):
+        """Un product_id al azar del historial del cliente o None."""
+        productos = self.productos_de(customer_id)
+        if len(productos) == 0:
+            return None
+        return int(productos[rng.randint(len(productos))])
+
+    @classmethod
+    def desde_pares(cls, clientes, productos, max_customer_id=None):
+        """Construye el CSR a partir de pares (customer_id, product_id) ordenados por cliente."""
+        clientes = np.asarray(clientes, dtype=np.int64)
+        unicos, inicios = np.unique(clientes, return_index=True)
+        indptr = np.append(inicios, len(clientes)).astype(np.int64)
+        tipo = np.int32 if len(productos) == 0 or np.max(productos) < np.iinfo(np.int32).max else np.int64
+        return cls(unicos, indptr, np.asarray(productos, dtype=tipo), max_customer_id)
+
+
+def construir_historial(chunksize=FEATURES_CHUNKSIZE):
+    """Recorre click_stream una vez, por bloques, y devuelve el HistorialClientes."""
+    clientes, productos = [], []
+    # Antes de recorrer click_stream: un cliente dado de alta durante el recorrido queda fuera del corte
+    max_cliente = pd.read_sql_query(query_max_cliente, engine)["max_customer_id"].iloc[0]
+    max_cliente = None if pd.isna(max_cliente) else int(max_cliente)
+    with engine.connect().execution_options(stream_results=True) as conn:
+        for bloque in pd.read_sql_query(query_historial, conn, chunksize=chunksize):
+            clientes.append(bloque["customer_id"].to_numpy(dtype=np.int64))
+            productos.append(bloque["product_id"].to_numpy(dtype=np.int64))
+
+    historial = HistorialClientes.desde_pares(
+        np.concatenate(clientes) if clientes else np.empty(0, dtype=np.int64),
+        np.concatenate(productos) if productos else np.empty(0, dtype=np.int64),
+        max_cliente
+    )
+    print(f"✅ Historial construido: {len(historial)} clientes, {len(historial.productos)} productos")
+    return historial
+
+
+def guardar_historial(historial):
+    os.makedirs(INDEX_DIR, exist_ok=True)
+    guardar_array(RUTA_HISTORIAL_CLIENTES, historial.clientes)
+    guardar_array(RUTA_HISTORIAL_INDPTR, historial.indptr)
+    guardar_array(RUTA_HISTORIAL_PRODUCTOS, historial.productos)
+    guardar_json(RUTA_HISTORIAL_META, {
+        "n_clientes": len(historial),
+        "n_productos": int(len(historial.productos)),
+        "max_customer_id": historial.max_customer_id,
+        "creado": datetime.now().isoformat(timespec="seconds"),
+    })
+
+
+def cargar_historial():
+    """Carga el historial persistido por tareas.py historial (mmap) o None si no existe."""
+    meta = leer_json(RUTA_HISTORIAL_META)
+    if not meta:
+        print("⚠️ No hay historial precalculado; se consultará click_stream en vivo")
+        return None
+    try:
+        historial = HistorialClientes(
+            np.load(RUTA_HISTORIAL_CLIENTES, mmap_mode="r"),
+            np.load(RUTA_HISTORIAL_INDPTR, mmap_mode="r"),
+            np.load(RUTA_HISTORIAL_PRODUCTOS, mmap_mode="r"),
+            meta.get("max_customer_id")
+        )
+        print(f"✅ Historial de clientes cargado: {len(historial)} clientes (creado {meta.get('creado')})")
+        return historial
+    except Exception as e:
+        print("⚠️ No se pudo cargar el historial de clientes:", e)
+        return None
+
+
+__all__ = ["HistorialClientes", "construir_historial", "guardar_historial", "cargar_historial"]
@@ -0,0 +1,234 @@
+import os
+import time
+import resource
+import tracemalloc
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+from annoy import AnnoyIndex
+
+from app.db import engine
+from app.config import INDEX_DIR, ANNOY_N_TREES, FEATURES_CHUNKSIZE, FEATURES_DTYPE
+from app.artefactos import leer_json, guardar_array, guardar_json
+from app.vectores import MatrizFeatures
+
+METRICA = "angular"
+
+# Artefacto del índice: fichero Annoy + tabla de product_id por posición
+# + matriz de features normalizada (en FEATURES_DTYPE) + metadatos
+RUTA_INDICE = os.path.join(INDEX_DIR, "productos.ann")
+RUTA_IDS = os.path.join(INDEX_DIR, "productos_ids.npy")
+RUTA_FEATURES = os.path.join(INDEX_DIR, "productos_features.npy")
+RUTA_META = os.path.join(INDEX_DIR, "productos_meta.json")
+
+# Huella de los datos de origen calculada en PostgreSQL (no se transfieren las features)
+query_huella = """
+SELECT count(*) AS n, md5(string_agg(md5(pf::text), '' ORDER BY pf.product_id)) AS huella
+FROM public.product_features_encoded pf
+"""
+
+
+def calcular_huella_catalogo():
+    """
+    Devuelve una huella de product_features_encoded. Cambia si se añade,
+    elimina o modifica cualquier producto. Devuelve None si no se puede calcular.
+    """
+    try:
+        fila = pd.read_sql_query(query_huella, engine).iloc[0]
+        return f"{int(fila['n'])}-{fila['huella']}"
+    except Exception as e:
+        print("⚠️ No se pudo calcular la huella del catálogo:", e)
+        return None
+
+
+query_num_productos = "SELECT count(*) AS n FROM public.product_features_encoded"
+query_features = "SELECT * FROM public.product_features_encoded ORDER BY product_id"
+
+
+def cargar_matriz_features(chunksize=FEATURES_CHUNKSIZE):
+    """
+    Lee product_features_encoded por bloques y los copia en una única matriz
+    float32 contigua, sin materializar la tabla completa en un DataFrame.
+
+    Devuelve (ids, matriz, feature_cols) con ids[i] = product_id de la fila i.
+    """
+    # Conteo y lectura en la misma transacción para ver un catálogo consistente
+    with engine.connect().execution_options(isolation_level="REPEATABLE READ", stream_results=True) as conn:
+        n = int(pd.read_sql_query(query_num_productos, conn).iloc[0]["n"])
+        ids = np.empty(n, dtype=np.int64)
+        matriz = None
+        feature_cols = []
+        pos = 0
+        for bloque in pd.read_sql_query(query_features, conn, chunksize=chunksize):
+            if matriz is None:
+                feature_cols = [col for col in bloque.columns if col != "product_id"]
+                matriz = np.empty((n, len(feature_cols)), dtype=np.float32)
+            fin = pos + len(bloque)
+            ids[pos:fin] = bloque["product_id"].to_numpy(dtype=np.int64)
+            matriz[pos:fin] = bloque[feature_cols].to_numpy(dtype=np.float32, na_value=0.0)
+            pos = fin
+
+    if matriz is None:
+        matriz = np.empty((0, 0), dtype=np.float32)
+    return ids, matriz, feature_cols
+
+
+def normalizar_filas(matriz):
+    """Normaliza cada fila a norma 1 (in place). Las filas nulas se dejan a cero."""
+    normas = np.linalg.norm(matriz, axis=1, keepdims=True)
+    normas[normas == 0] = 1.0
+    matriz /= normas
+    return matriz
+
+
+def construir_indice_annoy(features, n_trees=ANNOY_N_TREES):
+    """
+    Construye el índice Annoy a partir de la MatrizFeatures (decuantizada por
+    bloques). La fila i de la matriz es el item i del índice.
+    """
+    indice = AnnoyIndex(features.shape[1], METRICA)
+    for inicio, bloque in features.bloques():
+        for j in range(len(bloque)):
+            indice.add_item(inicio + j, bloque[j])
+    indice.build(n_trees, n_jobs=-1)
+    return indice
+
+
+def construir_indice_desde_bd(n_trees=ANNOY_N_TREES):
+    """
+    Carga las features por bloques y construye el índice, informando del
+    tiempo de cada fase y del pico de memoria.
+
+    Devuelve (annoy_index, ids, feature_cols, features) con features como
+    MatrizFeatures normalizada y almacenada en FEATURES_DTYPE.
+    """
+    medir_memoria = not tracemalloc.is_tracing()
+    if medir_memoria:
+        tracemalloc.start()
+
+    inicio = time.perf_counter()
+    ids, matriz, feature_cols = cargar_matriz_features()
+    # La métrica angular no depende de la norma: la matriz normalizada sirve para Annoy y para la búsqueda exacta
+    normalizar_filas(matriz)
+    bytes_float32 = matriz.nbytes
+    features = MatrizFeatures.cuantizar(matriz, FEATURES_DTYPE)
+    del matriz
+    t_carga = time.perf_counter() - inicio
+    indice = construir_indice_annoy(features, n_trees)
+    t_total = time.perf_counter() - inicio
+
+    # tracemalloc cubre pandas/NumPy; la memoria de Annoy (C++) solo aparece en el RSS
+    pico_py = tracemalloc.get_traced_memory()[1] / 2**20
+    if medir_memoria:
+        tracemalloc.stop()
+    pico_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+    print(
+        f"⏱️ Índice construido: {len(ids)} productos x {len(feature_cols)} features "
+        f"(carga {t_carga:.1f}s, total {t_total:.1f}s, features {features.modo} "
+        f"{features.nbytes / 2**20:.1f} MiB frente a {bytes_float32 / 2**20:.1f} MiB en float32, "
+        f"pico Python {pico_py:.1f} MiB, pico RSS {pico_rss:.1f} MiB)"
+    )
+    return indice, ids, feature_cols, features
+
+
+def leer_meta_indice():
+    """Metadatos del índice persistido (huella, features, árboles...) o None."""
+    return leer_json(RUTA_META)
+
+
+def meta_compatible(meta):
+    """True si el índice persistido se construyó con la configuración actual (árboles y tipo de features)."""
+    return bool(meta) and meta.get("n_trees") == ANNOY_N_TREES and meta.get("features_dtype", "float32") == FEATURES_DTYPE
+
+
+def guardar_indice(indice, ids, features, meta):
+    """
+    Guarda el índice, la tabla de ids, la matriz de features y los metadatos. Cada fichero se escribe
+    en un temporal y se renombra; los metadatos se escriben los últimos.
+    """
+    os.makedirs(INDEX_DIR, exist_ok=True)
+
+    # Tras save() Annoy pasa a usar el fichero mapeado en memoria
+    tmp = f"{RUTA_INDICE}.tmp{os.getpid()}"
+    indice.save(tmp)
+    os.replace(tmp, RUTA_INDICE)
+
+    guardar_array(RUTA_IDS, ids)
+    features.guardar(RUTA_FEATURES)
+    guardar_json(RUTA_META, meta)
+
+
+def cargar_indice(vector_dim):
+    """Carga el índice con mmap: varios procesos comparten la misma copia en la caché de páginas."""
+    indice = AnnoyIndex(vector_dim, METRICA)
+    indice.load(RUTA_INDICE)
+    return indice
+
+
+def cargar_indice_persistido(meta=None):
+    """
+    Carga el artefacto del índice sin consultar PostgreSQL. Devuelve
+    (annoy_index, ids, feature_cols, features) o None si no existe o falla.
+    """
+    meta = meta or leer_meta_indice()
+    if not meta:
+        return None
+    try:
+        ids = np.load(RUTA_IDS)
+        features = MatrizFeatures.cargar(RUTA_FEATURES)
+        feature_cols = meta["feature_cols"]
+        indice = cargar_indice(len(feature_cols))
+        print(f"✅ Índice Annoy cargado desde disco: {indice.get_n_items()} productos")
+        return indice, ids, feature_cols, features
+    except Exception as e:
+        print("⚠️ No se pudo cargar el índice persistido:", e)
+        return None
+
+
+def cargar_o_construir_indice():
+    """
+    Devuelve (annoy_index, ids, feature_cols, features) donde ids[i] es el
+    product_id del item i y features la MatrizFeatures de los vectores (mapeada
+    en memoria cuando viene de disco).
+    Usa el artefacto en disco si la huella de los datos coincide; si no,
+    construye el índice y lo persiste para el siguiente arranque.
+    """
+    huella = calcular_huella_catalogo()
+    meta = leer_meta_indice()
+
+    if (
+        huella
+        and meta_compatible(meta)
+        and meta.get("huella") == huella
+    ):
+        persistido = cargar_indice_persistido(meta)
+        if persistido is not None:
+            return persistido
+
+    print("🔨 Construyendo índice Annoy...")
+    indice, ids, feature_cols, features = construir_indice_desde_bd()
+
+    if huella:
+        meta = {
+            "huella": huella,
+            "feature_cols": feature_cols,
+            "vector_dim": len(feature_cols),
+            "metrica": METRICA,
+            "n_trees": ANNOY_N_TREES,
+            "features_dtype": features.modo,
+            "n_items": indice.get_n_items(),
+            "creado": datetime.now().isoformat(timespec="seconds"),
+        }
+        try:
+            guardar_indice(indice, ids, features, meta)
+            print(f"💾 Índice Annoy guardado en {INDEX_DIR}")
+            features = MatrizFeatures.cargar(RUTA_FEATURES)
+        except Exception as e:
+            print("⚠️ No se pudo guardar el índice:", e)
+
+    return indice, ids, feature_cols, features
+
+
+__all__ = ["calcular_huella_catalogo", "cargar_matriz_features", "normalizar_filas", "construir_indice_annoy", "construir_indice_desde_bd", "leer_meta_indice", "meta_compatible", "guardar_indice", "cargar_indice", "cargar_indice_persistido", "cargar_o_construir_indice"]
@@ -3,13 +3,10 @@ from telegram import Update
 from telegram.ext import ContextTypes
 #import app.estado
 from app.estado import get_estado, reset_estado
-from app.db import engine
+from app.db import en_hilo_bd
+from app.clientes import directorio_clientes
 from app.recomendador import (
-    obtener_producto_base,
-    obtener_recomendaciones_similares,
-    df_annoy,
-    annoy_index,
-    reverse_id_map,
+    catalogo_actual,
     recomendar_desde_historial_telegram,
     buscar_con_minimo_productos_telegram,
     mostrar_productos_telegram,
@@ -22,110 +19,46 @@ from app.responses import (
     chain_descripcion_producto,
     chain_recomendacion_historial,
     chain_sugerencias_post,
-    chain_detectar_id_cliente,
     chain_fuera_de_dominio,
-    chain_interpretacion_general,
-    chain_detectar_id_cliente
+    chain_interpretacion_general
 )
 
 from app.utils import responder_fuera_de_dominio_telegram
-
-import pandas as pd
-
-# ➕ función: detectar si el mensaje es un saludo
-async def detectar_y_responder_saludo_llm( mensaje_usuario, update, context):
-    """
-    Detecta si el mensaje del usuario es un saludo mediante LLM.
-    Si lo es, genera una respuesta adecuada y la envía por Telegram.
-    Devuelve True si fue un saludo, False en caso contrario.
-    """
-    from langchain_core.prompts import PromptTemplate
-    from langchain_core.runnables import RunnableSequence
-
-
-    chat_id = update.effective_chat.id
-    estado = get_estado(chat_id)  
-    
-    # 1. Prompt para detectar saludo
-    prompt_detectar_saludo = PromptTemplate.from_template("""
-Analiza el siguiente mensaje y responde solo con "SALUDO" si el usuario está saludando (ej. hola, buenos días, hey, etc.).
-
-En cualquier otro caso responde exactamente con "NO".
-
-Mensaje: "{mensaje_usuario}"
-""")
-
-    try:
-        es_saludo = RunnableSequence(prompt_detectar_saludo | llm).invoke({"mensaje_usuario": mensaje_usuario}).content.strip().upper()
-    except Exception as e:
-        print("⚠️ Error detectando saludo:", e)
-        return False
-
-    if es_saludo != "SALUDO":
-        return False
-
-    # 2. Generar respuesta personalizada con LLM
-    prompt_respuesta_saludo = PromptTemplate.from_template("""
-Eres un asistente de moda profesional y amable. El usuario te ha saludado.
-
-Cliente identificado: {cliente_identificado}
-Nombre del cliente: {nombre}
-
-Redacta un saludo apropiado. Si el cliente no está identificado, sugiere que puede hacerlo para recibir recomendaciones personalizadas.
-
-Si ya está identificado, salúdalo por su nombre y sugiérele explorar productos o ver algo similar.
-
-Máximo 3 frases.
-""")
-
-    entrada = {
-        "cliente_identificado": "sí" if estado.get("customer_id") else "no",
-        "nombre": estado.get("nombre") or "usuario"
-    }
-
-    try:
-        respuesta = RunnableSequence(prompt_respuesta_saludo | llm).invoke(entrada).content.strip()
-    except Exception as e:
-        print("⚠️ Error generando saludo:", e)
-        respuesta = "👋 ¡Hola! ¿Te gustaría ver alguna prenda o identificarte como cliente?"
-
+from app.router import enrutar_mensaje
+from app.presupuesto import con_presupuesto, llamar_llm
+
+# ➕ función: responder a un saludo (texto del LLM si lo trae la interpretación; si no, plantilla)
+async def responder_saludo(update, estado, respuesta=None):
+    if not respuesta and estado.get("customer_id"):
+        respuesta = (
+            f"👋 ¡Hola de nuevo, {estado.get('nombre') or 'cliente'}! "
+            "¿Quieres explorar alguna prenda o ver algo similar a lo último que viste?"
+        )
+    elif not respuesta:
+        respuesta = (
+            "👋 ¡Hola! ¿Te gustaría ver alguna prenda? "
+            "Si me dices tu número de cliente (ej. \"cliente 123\") te recomendaré productos según tu historial."
+        )
     await update.message.reply_text(respuesta)
-    return True
-
-# ➕ función: detectar intención general (simplificada)
-def detectar_intencion_simple(mensaje_usuario):
-    mensaje = mensaje_usuario.lower()
 
-    if any(palabra in mensaje for palabra in ["cliente", "soy", "id"]):
-        return "identificar"
-    if any(palabra in mensaje for palabra in ["ver", "mostrar", "buscar", "enséñame"]):
-        return "buscar"
-    if "similares" in mensaje:
-        return "similares"
-    if any(palabra in mensaje for palabra in ["más info", "detalles", "quiero saber"]):
-        return "detalle"
-    if "reiniciar" in mensaje:
-        return "reiniciar"
-    return "nada"
-
-# ➕ función: procesar mensaje completo
-def detectar_id_cliente_llm(mensaje):
+# ➕ función: producto mostrado al que se refiere el usuario
+async def producto_seleccionado(update, mensaje_usuario, estado, detalles):
+    mostrados = estado["productos_mostrados"]
+    if not mostrados:
+        return None
     try:
-        return chain_detectar_id_cliente.invoke({"mensaje": mensaje}).content.strip()
-    except Exception as e:
-        print("⚠️ Error procesando mensaje con LLM:", e)
-        return ""
+        seleccion = int(detalles.get("seleccion"))
+    except (TypeError, ValueError):
+        seleccion = None
+    if seleccion is not None and 1 <= seleccion <= len(mostrados):
+        return mostrados[seleccion - 1]
+    # La interpretación no trajo una posición válida: se pregunta al LLM por el producto
+    return await identificar_producto_seleccionado(update, mensaje_usuario, mostrados)
 
 # ➕ función: obtener nombre cliente
 def obtener_nombre_cliente(cid):
-    try:
-        df = pd.read_sql_query(f"SELECT first_name, last_name FROM customers WHERE customer_id = {cid}", engine)
-        if not df.empty:
-            return f"{df.iloc[0]['first_name']} {df.iloc[0]['last_name']}"
-        return None
-    except Exception as e:
-        print("❌ Error al buscar cliente:", e)
-        return None
+    # Directorio en memoria; solo los clientes nuevos llegan a la base de datos
+    return directorio_clientes.nombre(cid)
         
 # ➕ función: generar mensaje de bienvenida
 async def generar_mensaje_bienvenida_llm(nombre_cliente):
@@ -139,71 +72,79 @@ Redacta un mensaje breve (1 o 2 frases) que le dé la bienvenida al sistema de r
 explicando que estás listo para ayudarle a descubrir nuevos artículos de moda que podrían interesarle.
 Usa un tono cercano y profesional.
 """
-    try:
-        respuesta = llm.invoke(prompt_saludo).content.strip()
+    respuesta = await llamar_llm(llm, prompt_saludo)
+    if respuesta:
         return f"🤖 {respuesta}"
-    except Exception as e:
-        print("⚠️ Error generando mensaje de bienvenida LLM:", e)
-        return f"👤 Cliente identificado: {nombre_cliente}. ¡Bienvenido!"
+    return f"👤 Cliente identificado: {nombre_cliente}. ¡Bienvenido!"
 
         
-# ➕ función: procesar mensaje completo
+# ➕ función: procesar mensaje completo (con presupuesto de tiempo para todas sus llamadas al LLM)
+@con_presupuesto
 async def manejar_mensaje(update: Update, context: ContextTypes.DEFAULT_TYPE):
     #global estado.estado_usuario, estado.producto_base, estado.productos_mostrados, estado.filtros_actuales
     chat_id = update.effective_chat.id
     estado = get_estado(chat_id)    
     mensaje_usuario = update.message.text.strip()
+    # Una sola versión del catálogo para todo el mensaje, aunque se publique otra mientras tanto
+    snapshot = catalogo_actual()
     
-    # 1. Detectar saludo
-    if await detectar_y_responder_saludo_llm(mensaje_usuario, update, context):
-        return
-
-    # Construcción de entrada para el prompt maestro
-    nombre_cliente = estado["nombre"] or "no identificado"
-    productos_nombres = [p["productdisplayname"] for p in estado["productos_mostrados"]]
-    nombre_producto_base = estado["producto_base"]["productdisplayname"] if estado["producto_base"] else ""
-
-    entrada_llm = {
-        "mensaje_usuario": mensaje_usuario,
-        "cliente_nombre": nombre_cliente,
-        "productos_listados": "\n".join(f"{i+1}. {n}" for i, n in enumerate(productos_nombres)),
-    }
-
-    try:
-        respuesta_raw = chain_interpretacion_general.invoke(entrada_llm).content.strip()
-        decision = json.loads(respuesta_raw)
-    except Exception as e:
-        print("⚠️ Error interpretando intención:", e)
-        await update.message.reply_text("❌ No entendí lo que querías. ¿Podrías reformularlo?")
-        return
+    # 1. Enrutado local: "hola", "cliente 123", "reiniciar", "el segundo"... sin llamar al LLM
+    decision = enrutar_mensaje(mensaje_usuario, estado)
+
+    if decision is None:
+        # 2. Una sola llamada al LLM: intención (saludo incluido), filtros, cliente y producto
+        nombre_cliente = estado["nombre"] or "no identificado"
+        productos_nombres = [p["productdisplayname"] for p in estado["productos_mostrados"]]
+
+        entrada_llm = {
+            "mensaje_usuario": mensaje_usuario,
+            "cliente_nombre": nombre_cliente,
+            "productos_listados": "\n".join(f"{i+1}. {n}" for i, n in enumerate(productos_nombres)),
+        }
+
+        try:
+            respuesta_raw = await llamar_llm(chain_interpretacion_general, entrada_llm)
+            if respuesta_raw is None:
+                raise ValueError("sin respuesta del LLM")
+            decision = json.loads(respuesta_raw)
+        except Exception as e:
+            print("⚠️ Error interpretando intención:", e)
+            await update.message.reply_text("❌ No entendí lo que querías. ¿Podrías reformularlo?")
+            return
+    else:
+        print(f"⚡ Intención resuelta localmente: {decision}")
 
     accion = decision.get("accion")
     detalles = decision.get("detalles", {})
 
     # --- Acciones ---
-    if accion == "identificar":
+    if accion == "saludo":
+        await responder_saludo(update, estado, detalles.get("respuesta"))
+
+    elif accion == "identificar":
         msg_temp = await update.message.reply_text("procesando...")
-        texto = detalles.get("texto", mensaje_usuario)
-        respuesta_id = detectar_id_cliente_llm(texto)
-        if respuesta_id.startswith("ID:"):
-            cid = int(respuesta_id.replace("ID:", "").strip())
-            nombre = obtener_nombre_cliente(cid)
+        try:
+            cid = int(detalles.get("customer_id"))
+        except (TypeError, ValueError):
+            cid = None
+        if cid is not None:
+            nombre = await en_hilo_bd(obtener_nombre_cliente, cid)
             if nombre:
                 estado["customer_id"] = cid
                 estado["nombre"] = nombre             
                 mensaje_bienvenida = await generar_mensaje_bienvenida_llm(nombre)
                 await update.message.reply_text(mensaje_bienvenida)
-                await recomendar_desde_historial_telegram(update, context)
+                await recomendar_desde_historial_telegram(update, context, snapshot)
             else:
                 await update.message.reply_text(f"⚠️ No encontré ningún cliente con el ID {cid}. Intenta de nuevo.")
         else:
-            await update.message.reply_text(respuesta_id)
+            await update.message.reply_text("🔢 Indícame tu número de cliente, por ejemplo \"cliente 456\".")
         await context.bot.delete_message(chat_id=msg_temp.chat_id, message_id=msg_temp.message_id)
         
     elif accion == "buscar":
         msg_temp = await update.message.reply_text("procesando...")
         filtros_detectados = detalles.get("filtros", {})
-        productos, filtros_usados = await buscar_con_minimo_productos_telegram(update, context, filtros_detectados)
+        productos, filtros_usados = await buscar_con_minimo_productos_telegram(update, context, filtros_detectados, snapshot=snapshot)
         estado["filtros_actuales"] = filtros_usados
         if productos.empty:
             await update.message.reply_text("❌ No encontré productos con esos filtros. ¿Quieres probar otra categoría o color?")
@@ -218,7 +159,7 @@ async def manejar_mensaje(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await context.bot.delete_message(chat_id=msg_temp.chat_id, message_id=msg_temp.message_id)
     elif accion == "detalle":
         msg_temp = await update.message.reply_text("procesando...")
-        producto = identificar_producto_seleccionado(update, mensaje_usuario, estado["productos_mostrados"])
+        producto = await producto_seleccionado(update, mensaje_usuario, estado, detalles)
         if producto:
             await mostrar_detalles_producto_telegram(producto, update, context)
         else:
@@ -228,7 +169,7 @@ async def manejar_mensaje(update: Update, context: ContextTypes.DEFAULT_TYPE):
         #print("mensaje usuario: ", mensaje_usuario)
         #print("procutos mostrados: ", productos_mostrados)
         msg_temp = await update.message.reply_text("procesando...")
-        producto = identificar_producto_seleccionado(update, mensaje_usuario, estado["productos_mostrados"])
+        producto = await producto_seleccionado(update, mensaje_usuario, estado, detalles)
         if producto:
             estado["producto_base"] = producto
         elif not estado["producto_base"]:
@@ -238,12 +179,11 @@ async def manejar_mensaje(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text(f"🔁 Buscando productos similares a: {estado['producto_base']['productdisplayname']}")
         await recomendar_productos_similares_annoy_con_llm(
             estado["producto_base"],
-            df_annoy,
-            annoy_index,
-            reverse_id_map,
+            snapshot,
             llm,
             update,
-            context
+            context,
+            filtros=detalles.get("filtros")
         )
         await context.bot.delete_message(chat_id=msg_temp.chat_id, message_id=msg_temp.message_id)
     elif accion == "reiniciar":
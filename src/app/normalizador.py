@@ -0,0 +1,176 @@
+import re
+import difflib
+
+from app.config import NORMALIZADOR_UMBRAL, NORMALIZADOR_CONFIANZA_MIN
+from app.atributos import COLUMNAS_FILTRO, clave_valor, valores_filtro
+from app.router import normalizar_texto
+
+# --- Corrección local de filtros contra el vocabulario real del catálogo ---
+
+# Nombres de columna que suele proponer el usuario o el LLM
+SINONIMOS_COLUMNA = {
+    "genero": "gender", "sexo": "gender",
+    "categoria": "mastercategory", "category": "mastercategory", "master_category": "mastercategory",
+    "subcategoria": "subcategory", "sub_category": "subcategory",
+    "tipo": "articletype", "articulo": "articletype", "prenda": "articletype", "article_type": "articletype",
+    "color": "basecolour", "colour": "basecolour", "base_colour": "basecolour", "basecolor": "basecolour",
+    "temporada": "season", "estacion": "season",
+    "ano": "year", "anio": "year",
+    "uso": "usage", "ocasion": "usage", "occasion": "usage",
+}
+
+# Términos habituales (en español y variantes en inglés) -> valor del catálogo.
+# Solo se aplican si el valor existe en la columna filtrada.
+SINONIMOS_VALOR = {
+    # gender
+    "hombre": "Men", "hombres": "Men", "caballero": "Men", "masculino": "Men", "man": "Men",
+    "mujer": "Women", "mujeres": "Women", "dama": "Women", "femenino": "Women", "woman": "Women",
+    "nino": "Boys", "ninos": "Boys", "boy": "Boys",
+    "nina": "Girls", "ninas": "Girls", "girl": "Girls",
+    "unisex": "Unisex",
+    # mastercategory
+    "ropa": "Apparel", "accesorios": "Accessories", "accesorio": "Accessories",
+    "calzado": "Footwear", "zapatos": "Footwear", "cuidado personal": "Personal Care",
+    # basecolour
+    "rojo": "Red", "negro": "Black", "blanco": "White", "azul": "Blue", "azul marino": "Navy Blue",
+    "marino": "Navy Blue", "verde": "Green", "amarillo": "Yellow", "rosa": "Pink", "gris": "Grey",
+    "gray": "Grey", "marron": "Brown", "cafe": "Brown", "morado": "Purple", "violeta": "Purple",
+    "naranja": "Orange", "beis": "Beige", "beige": "Beige", "dorado": "Gold", "plateado": "Silver",
+    "plata": "Silver", "granate": "Maroon", "burdeos": "Maroon", "crema": "Cream", "caqui": "Khaki",
+    "turquesa": "Turquoise Blue", "multicolor": "Multi", "oliva": "Olive",
+    # articletype
+    "camiseta": "Tshirts", "tshirt": "Tshirts", "t shirt": "Tshirts", "playera": "Tshirts",
+    "camisa": "Shirts", "vaqueros": "Jeans", "vaquero": "Jeans", "jean": "Jeans",
+    "pantalon": "Trousers", "pantalones": "Trousers", "pantalon corto": "Shorts", "bermuda": "Shorts",
+    "vestido": "Dresses", "falda": "Skirts", "top": "Tops", "chaqueta": "Jackets", "cazadora": "Jackets",
+    "sudadera": "Sweatshirts", "jersey": "Sweaters", "sueter": "Sweaters",
+    "reloj": "Watches", "bolso": "Handbags", "cartera": "Wallets", "billetera": "Wallets",
+    "mochila": "Backpacks", "cinturon": "Belts", "gafas de sol": "Sunglasses", "gafas": "Sunglasses",
+    "lentes de sol": "Sunglasses", "gorra": "Caps", "calcetines": "Socks", "calcetin": "Socks",
+    "zapatillas": "Sports Shoes", "zapatillas deportivas": "Sports Shoes", "deportivas": "Sports Shoes",
+    "zapato": "Casual Shoes", "zapatos casuales": "Casual Shoes", "zapatos formales": "Formal Shoes",
+    "tacones": "Heels", "tacon": "Heels", "sandalia": "Sandals", "sandalias": "Sandals",
+    "chanclas": "Flip Flops", "chancla": "Flip Flops", "pulsera": "Bracelet", "collar": "Necklace and Chains",
+    # season
+    "verano": "Summer", "invierno": "Winter", "primavera": "Spring", "otono": "Fall", "autumn": "Fall",
+    # usage
+    "informal": "Casual", "diario": "Casual", "formal": "Formal", "deporte": "Sports", "deportivo": "Sports",
+    "fiesta": "Party", "viaje": "Travel", "etnico": "Ethnic", "elegante": "Formal",
+}
+
+
+def clave_texto(valor):
+    """Forma comparable de un valor: sin tildes, minúsculas y solo letras, números y espacios."""
+    return re.sub(r"[^a-z0-9ñ]+", " ", normalizar_texto(str(valor))).strip()
+
+
+def variantes(clave):
+    """La clave y sus formas singular/plural y masculina/femenina más habituales."""
+    formas = [clave]
+    if clave.endswith("es"):
+        formas.append(clave[:-2])
+    if clave.endswith("s"):
+        formas.append(clave[:-1])
+    else:
+        formas += [clave + "s", clave + "es"]
+    formas += [f[:-1] + "o" for f in list(formas) if f.endswith("a")]
+    formas.append(clave.replace(" ", ""))
+    return formas
+
+
+class NormalizadorFiltros:
+    """
+    Corrige los valores de los filtros contra los valores existentes de cada
+    columna: coincidencia sin mayúsculas ni tildes, singular/plural,
+    sinónimos y, por último, similitud de cadenas (difflib).
+
+    Las correcciones con confianza menor que `confianza_min` no se aplican:
+    quedan pendientes para el LLM ("shorts" no se convierte en "Shirts").
+    """
+
+    def __init__(self, vocabulario, umbral=NORMALIZADOR_UMBRAL, confianza_min=NORMALIZADOR_CONFIANZA_MIN):
+        self.umbral = umbral
+        self.confianza_min = confianza_min
+        # Por columna: clave comparable -> valor del catálogo
+        self.claves = {
+            col: {clave_texto(v): v for v in valores}
+            for col, valores in vocabulario.items()
+        }
+        for col, claves in self.claves.items():
+            for clave in list(claves):
+                claves.setdefault(clave.replace(" ", ""), claves[clave])
+
+    def columna(self, col):
+        clave = clave_texto(col).replace(" ", "_")
+        if clave in COLUMNAS_FILTRO:
+            return clave
+        return SINONIMOS_COLUMNA.get(clave) or SINONIMOS_COLUMNA.get(clave.replace("_", ""))
+
+    def valor(self, col, valor):
+        """(valor del catálogo, confianza) o (None, 0.0) si no se puede resolver."""
+        claves = self.claves.get(col) or {}
+        if not claves:
+            return None, 0.0
+        clave = clave_texto(clave_valor(valor) or "")
+        if not clave:
+            return None, 0.0
+
+        if clave in claves:
+            return claves[clave], 1.0
+        for forma in variantes(clave):
+            if forma in claves:
+                return claves[forma], 0.95
+        for forma in variantes(clave):
+            sinonimo = SINONIMOS_VALOR.get(forma)
+            if sinonimo is not None and clave_texto(sinonimo) in claves:
+                return claves[clave_texto(sinonimo)], 0.9
+
+        parecidos = difflib.get_close_matches(clave, list(claves), n=1, cutoff=self.umbral)
+        if parecidos:
+            ratio = difflib.SequenceMatcher(None, clave, parecidos[0]).ratio()
+            return claves[parecidos[0]], round(ratio, 3)
+        return None, 0.0
+
+    def normalizar(self, filtros):
+        """
+        Devuelve (filtros corregidos, confianza, pendientes). La confianza es la
+        menor de los valores resueltos; `pendientes` tiene, con su columna
+        original, lo que no se pudo resolver localmente con suficiente confianza.
+        """
+        corregidos, pendientes, confianzas = {}, {}, []
+        for col_original, val in (filtros or {}).items():
+            col = self.columna(col_original)
+            if col is None:
+                pendientes[col_original] = val
+                continue
+            resueltos, sin_resolver = [], []
+            for v in valores_filtro(val):
+                valor, confianza = self.valor(col, v)
+                if valor is None or confianza < self.confianza_min:
+                    sin_resolver.append(v)
+                elif valor not in resueltos:
+                    resueltos.append(valor)
+                    confianzas.append(confianza)
+            if resueltos:
+                # "tipo" y "articletype" pueden llegar a la vez: se unen sus valores
+                corregidos = fusionar_filtros(corregidos, {
+                    col: resueltos if isinstance(val, (list, tuple, set)) else resueltos[0]
+                })
+            if sin_resolver:
+                pendientes[col_original] = sin_resolver if isinstance(val, (list, tuple, set)) else sin_resolver[0]
+        return corregidos, (min(confianzas) if confianzas else 1.0), pendientes
+
+
+def fusionar_filtros(a, b):
+    """Une dos dicts de filtros; si una columna está en ambos, se juntan sus valores."""
+    resultado = dict(a)
+    for col, val in (b or {}).items():
+        if col in resultado:
+            union = valores_filtro(resultado[col]) + [v for v in valores_filtro(val) if v not in valores_filtro(resultado[col])]
+            resultado[col] = union if len(union) > 1 else union[0]
+        else:
+            resultado[col] = val
+    return resultado
+
+
+__all__ = ["SINONIMOS_COLUMNA", "SINONIMOS_VALOR", "NormalizadorFiltros", "fusionar_filtros"]
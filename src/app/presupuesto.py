@@ -0,0 +1,122 @@
+import time
+import asyncio
+import threading
+import contextvars
+from functools import wraps
+
+from app.config import PRESUPUESTO_MENSAJE_S, LLM_PLAZO_PASO_S, LLM_CIRCUITO_FALLOS, LLM_CIRCUITO_ESPERA_S
+
+# --- Presupuesto de tiempo por mensaje y circuito del LLM ---
+
+# Instante (time.monotonic) en que vence el presupuesto del mensaje que se está atendiendo.
+# Es una ContextVar: las tareas lanzadas desde el handler heredan su valor.
+_vencimiento = contextvars.ContextVar("vencimiento_mensaje", default=None)
+
+
+def tiempo_restante():
+    """Segundos que le quedan al mensaje actual (infinito fuera de un handler)."""
+    vence = _vencimiento.get()
+    return float("inf") if vence is None else max(0.0, vence - time.monotonic())
+
+
+def plazo_paso(maximo=LLM_PLAZO_PASO_S):
+    """Plazo de un paso: `maximo`, recortado a lo que queda del presupuesto del mensaje."""
+    return min(maximo, tiempo_restante())
+
+
+# 🔸 Decorador de handlers de Telegram: cada mensaje recibe PRESUPUESTO_MENSAJE_S segundos
+def con_presupuesto(func):
+    @wraps(func)
+    async def wrapper(update, context, *args, **kwargs):
+        token = _vencimiento.set(time.monotonic() + PRESUPUESTO_MENSAJE_S)
+        try:
+            return await func(update, context, *args, **kwargs)
+        finally:
+            _vencimiento.reset(token)
+    return wrapper
+
+
+class CircuitoLLM:
+    """
+    Corta las llamadas al LLM mientras está degradado: tras `max_fallos`
+    fallos o plazos agotados seguidos se abre durante `espera` segundos, en
+    los que se usan directamente las plantillas. Pasado ese tiempo deja pasar
+    una llamada de prueba; si falla, vuelve a abrirse.
+    """
+
+    def __init__(self, max_fallos=LLM_CIRCUITO_FALLOS, espera=LLM_CIRCUITO_ESPERA_S):
+        self.max_fallos = max_fallos
+        self.espera = espera
+        self._fallos = 0
+        self._abierto_hasta = 0.0
+        self._lock = threading.Lock()
+
+    @property
+    def abierto(self):
+        return self._fallos >= self.max_fallos and time.monotonic() < self._abierto_hasta
+
+    def permitir(self):
+        """True si se puede llamar al LLM."""
+        with self._lock:
+            if self._fallos < self.max_fallos:
+                return True
+            ahora = time.monotonic()
+            if ahora >= self._abierto_hasta:
+                # Llamada de prueba: las demás siguen con plantilla hasta que se resuelva
+                self._abierto_hasta = ahora + self.espera
+                return True
+            return False
+
+    def exito(self):
+        with self._lock:
+            if self._fallos >= self.max_fallos:
+                print("✅ El LLM vuelve a responder; circuito cerrado")
+            self._fallos = 0
+
+    def fallo(self):
+        with self._lock:
+            self._fallos += 1
+            if self._fallos >= self.max_fallos:
+                self._abierto_hasta = time.monotonic() + self.espera
+                if self._fallos == self.max_fallos:
+                    print(f"🔌 LLM degradado ({self._fallos} fallos seguidos); se usan plantillas durante {self.espera}s")
+
+    def descripcion(self):
+        return f"abierto ({self._fallos} fallos seguidos)" if self.abierto else "cerrado"
+
+
+circuito_llm = CircuitoLLM()
+
+
+# 🔸 Llamada al LLM con plazo y plantilla de respaldo
+async def llamar_llm(runnable, entrada, texto_por_defecto=None, plazo=LLM_PLAZO_PASO_S):
+    """
+    `runnable.ainvoke(entrada)` con como mucho `plazo` segundos, recortados a
+    lo que quede del presupuesto del mensaje. Devuelve el texto de la
+    respuesta, o `texto_por_defecto` si el circuito está abierto, no queda
+    tiempo, se agota el plazo o la llamada falla.
+    """
+    plazo_efectivo = plazo_paso(plazo)
+    if plazo_efectivo <= 0 or not circuito_llm.permitir():
+        print("⏭️ LLM omitido (sin presupuesto o circuito abierto); se usa la plantilla")
+        return texto_por_defecto
+    try:
+        respuesta = await asyncio.wait_for(runnable.ainvoke(entrada), plazo_efectivo)
+    except asyncio.TimeoutError:
+        print(f"⏱️ El LLM no respondió en {plazo_efectivo:.1f}s; se usa la plantilla")
+        # Si el plazo lo recortó el presupuesto del mensaje, la lentitud no es solo del LLM
+        if plazo_efectivo >= plazo:
+            circuito_llm.fallo()
+        return texto_por_defecto
+    except Exception as e:
+        print("⚠️ Error llamando al LLM:", e)
+        circuito_llm.fallo()
+        return texto_por_defecto
+    circuito_llm.exito()
+    return respuesta.content.strip()
+
+
+__all__ = [
+    "tiempo_restante", "plazo_paso", "con_presupuesto",
+    "CircuitoLLM", "circuito_llm", "llamar_llm"
+]
@@ -1,16 +1,22 @@
 import random
 import pandas as pd
 import json
-from annoy import AnnoyIndex
 from sqlalchemy import text
-from app.db import engine
+from app.db import leer_sql, en_hilo_bd
+from app.atributos import COLUMNAS_FILTRO
+from app.consultas import buscar_productos_preparada, consulta_historial_cliente
+from app.snapshot import GestorCatalogo
 #import app.estado
 from app.estado import get_estado
-from app.config import OPENAI_API_KEY
+from app.config import OPENAI_API_KEY, CACHE_BUSQUEDAS_MAX, CACHE_BUSQUEDAS_TTL_S, LLM_TIMEOUT_S, LLM_MAX_REINTENTOS
+from app.cache import CacheLRU, clave_filtros
+from app.normalizador import NormalizadorFiltros, fusionar_filtros
+from app.ampliacion import AmpliadorFiltros
 from langchain_openai import ChatOpenAI
-from app.utils import es_imagen_valida
+from app.utils import es_imagen_valida, generar_textos_llm
+from app.presupuesto import llamar_llm
+from app.descripciones import describir_productos, almacen_descripciones, describir_producto_en_streaming
 from app.responses import (
-    chain_descripcion_producto,
     chain_recomendacion_historial,
     chain_sugerencias_post,
     chain_detectar_id_cliente,
@@ -19,8 +25,7 @@ from app.responses import (
     chain_detectar_id_cliente,
     chain_ampliacion_filtros,
     chain_validar_filtros_llm,
-    chain_seleccion,
-    chain_ampliar_info_producto
+    chain_seleccion
 )
 
 from telegram import InputMediaPhoto
@@ -29,109 +34,99 @@ from telegram import InputMediaPhoto
 URL_IMAGEN_DEFAULT = "https://upload.wikimedia.org/wikipedia/commons/1/14/No_Image_Available.jpg"
 
 # Inicializar el modelo LLM (GPT-5)
-llm = ChatOpenAI(model="gpt-5", temperature=0.5, openai_api_key=OPENAI_API_KEY)
-
-# --- Cargar productos desde la base de datos
-query_productos = """
-SELECT pf.*, p.productdisplayname, p.image_url
-FROM public.product_features_encoded pf
-LEFT JOIN (
-    SELECT DISTINCT product_id, productdisplayname, image_url
-    FROM public.cleaned_base_table
-) p ON pf.product_id = p.product_id
-"""
+llm = ChatOpenAI(
+    model="gpt-5", temperature=0.5, openai_api_key=OPENAI_API_KEY,
+    timeout=LLM_TIMEOUT_S, max_retries=LLM_MAX_REINTENTOS
+)
 
-try:
-    df_annoy = pd.read_sql(query_productos, engine)
-    print(f"✅ Datos de productos cargados: {len(df_annoy)} registros")
-except Exception as e:
-    print("❌ Error al cargar productos:", e)
-    df_annoy = pd.DataFrame()
+# --- Catálogo versionado: se carga al arrancar y se puede recargar en caliente (/recargar)
+gestor_catalogo = GestorCatalogo()
+gestor_catalogo.cargar()
 
-# --- Construir índice Annoy
-feature_cols = [col for col in df_annoy.columns if col not in ['product_id', 'productdisplayname', 'image_url']]
-vector_dim = len(feature_cols)
-annoy_index = AnnoyIndex(vector_dim, 'angular')
 
-product_id_map = {}
-reverse_id_map = {}
+# --- Caché de búsquedas por filtros (se vacía al cambiar de versión del catálogo)
+cache_busquedas = CacheLRU(CACHE_BUSQUEDAS_MAX, CACHE_BUSQUEDAS_TTL_S)
 
-for i, row in df_annoy.iterrows():
-    try:
-        vector = row[feature_cols].values.astype('float32')
-        annoy_index.add_item(i, vector)
-        product_id_map[i] = row['product_id']
-        reverse_id_map[int(row['product_id'])] = i
-    except Exception as e:
-        print(f"⚠️ Error con producto {row.get('product_id', 'N/A')}: {e}")
 
-annoy_index.build(10)
-print(f"✅ Índice Annoy construido con {annoy_index.get_n_items()} productos")
+def catalogo_actual():
+    """
+    Versión vigente del catálogo. Cada mensaje debe tomarla una vez y usarla
+    hasta el final: las funciones de este módulo que consultan el catálogo
+    aceptan `snapshot` y solo toman la versión vigente si no se les pasa.
+    """
+    return gestor_catalogo.actual()
 
 
-def construir_where_clause(filtros):
-    condiciones = []
-    for col, val in filtros.items():
-        if isinstance(val, list):
-            valores_sql = ", ".join(f"'{v}'" for v in val)
-            condiciones.append(f"{col} IN ({valores_sql})")
-        else:
-            condiciones.append(f"{col} = '{val}'")
-    return " AND ".join(condiciones) if condiciones else "TRUE"
-
-def buscar_productos_en_db(filtros, limit=10):
-    where_clause = construir_where_clause(filtros)
-    query = f"""
-    SELECT id, productdisplayname, image_url
-    FROM products
-    WHERE {where_clause}
-    LIMIT {limit}
+def buscar_productos_en_db(filtros, limit=10, snapshot=None):
+    """
+    Productos (id, productdisplayname, image_url) que cumplen los filtros.
+    Se resuelve con el índice de atributos en memoria; la consulta SQL solo se
+    usa si el índice no se pudo cargar. Los resultados se guardan en
+    cache_busquedas hasta la siguiente versión del catálogo.
     """
+    snapshot = snapshot or catalogo_actual()
+    clave = (clave_filtros(filtros), limit)
+    productos = cache_busquedas.obtener(snapshot.version, clave)
+    if productos is None:
+        if snapshot.indice_atributos.n > 0:
+            productos = snapshot.indice_atributos.buscar(filtros, limit=limit).rename(columns={"product_id": "id"})
+            cache_busquedas.guardar(snapshot.version, clave, productos)
+        else:
+            # Sin índice no se guarda: un DataFrame vacío puede ser un error de la consulta
+            productos = buscar_productos_en_sql(filtros, limit)
+    # Copia: quien llama puede modificar el DataFrame
+    return productos.copy()
+
+
+def contar_productos(filtros, snapshot=None):
+    """Número exacto de productos que cumplen los filtros."""
+    return (snapshot or catalogo_actual()).indice_atributos.contar(filtros)
+
+
+def buscar_productos_en_sql(filtros, limit=10):
     try:
-        return pd.read_sql_query(query, engine)
+        return buscar_productos_preparada(filtros, limit)
     except Exception as e:
         print("❌ Error al buscar productos:", e)
         return pd.DataFrame()
 
 
+def buscar_similares_filtrados(filtros, producto_id_base=None, n=10, snapshot=None):
+    """Ver SnapshotCatalogo.buscar_similares_filtrados (por defecto sobre la versión vigente del catálogo)."""
+    return (snapshot or catalogo_actual()).buscar_similares_filtrados(filtros, producto_id_base, n)
+
+
 # --- Función pública para recomendar productos similares
-def obtener_recomendaciones_similares(producto_id_base, n=5):
-    if producto_id_base not in reverse_id_map:
+def obtener_recomendaciones_similares(producto_id_base, n=5, snapshot=None):
+    snapshot = snapshot or catalogo_actual()
+    idx_base = snapshot.catalogo.posicion(producto_id_base)
+    if idx_base is None:
         return []
 
-    idx_base = reverse_id_map[producto_id_base]
-    vecinos_ids, distancias = annoy_index.get_nns_by_item(idx_base, n + 1, include_distances=True)
-    vecinos = [
-        (product_id_map[i], round(1 - dist, 3))
-        for i, dist in zip(vecinos_ids, distancias)
-        if product_id_map[i] != producto_id_base
-    ]
-    return vecinos[:n]
+    return [(int(snapshot.catalogo.ids[i]), sim) for i, sim in snapshot.buscar_vecinos(idx_base, n)]
 
 # Función para obtener producto base como diccionario
-def obtener_producto_base(producto_id):
-    try:
-        producto = df_annoy[df_annoy['product_id'] == producto_id].iloc[0]
-        return producto.to_dict()
-    except Exception as e:
-        print("❌ Error obteniendo producto base:", e)
-        return None
+def obtener_producto_base(producto_id, snapshot=None):
+    producto = (snapshot or catalogo_actual()).catalogo.obtener(producto_id)
+    if producto is None:
+        print(f"❌ Error obteniendo producto base: {producto_id} no está en el catálogo")
+    return producto
 
-def obtener_producto_historial(cliente_id):
+def obtener_producto_historial(cliente_id, snapshot=None):
     """
     Devuelve un product_id aleatorio del historial de compras o visualizaciones del cliente.
+    Usa el historial precalculado; solo consulta click_stream si no existe o si el
+    cliente es posterior a su cálculo. Un cliente anterior sin historial
+    devuelve None sin consultar.
     """
+    historial = (snapshot or catalogo_actual()).historial
+    if historial is not None:
+        producto_id = historial.producto_aleatorio(int(cliente_id))
+        if producto_id is not None or historial.cubre(int(cliente_id)):
+            return producto_id
+
     try:
-        query = f"""
-        SELECT pem.product_id, p.productdisplayname, p.image_url 
-        FROM customers c
-        JOIN transactions t ON c.customer_id = t.customer_id
-        JOIN click_stream cs ON t.session_id = cs.session_id
-        JOIN product_event_metadata pem ON cs.event_id = pem.event_id
-        JOIN products p ON pem.product_id = p.id
-        WHERE c.customer_id = {cliente_id}
-        """
-        df = pd.read_sql_query(query, engine)
+        df = consulta_historial_cliente.ejecutar(int(cliente_id))
         if df.empty:
             return None
         return int(df.sample(1)['product_id'].values[0])
@@ -139,10 +134,11 @@ def obtener_producto_historial(cliente_id):
         print("❌ Error al obtener historial del cliente:", e)
         return None
 
-async def recomendar_desde_historial_telegram(update, context):
+async def recomendar_desde_historial_telegram(update, context, snapshot=None):
 #    global estado.producto_base, estado.productos_mostrados, estado.estado_usuario
     chat_id = update.effective_chat.id
     estado = get_estado(chat_id)    
+    snapshot = snapshot or catalogo_actual()
     
     cliente_id = estado.get("customer_id")
     nombre_cliente = estado.get("nombre")
@@ -153,13 +149,13 @@ async def recomendar_desde_historial_telegram(update, context):
 
     # 1. Obtener producto base del historial
     msg_temp = await update.message.reply_text("procesando...")
-    producto_id_base = obtener_producto_historial(cliente_id)
+    producto_id_base = await en_hilo_bd(obtener_producto_historial, cliente_id, snapshot)
     if not producto_id_base:
         await update.message.reply_text("ℹ️ No encontramos historial previo. Puedes pedirme algún tipo de prenda o color.")
         await context.bot.delete_message(chat_id=msg_temp.chat_id, message_id=msg_temp.message_id)
         return
 
-    if producto_id_base not in reverse_id_map:
+    if producto_id_base not in snapshot.catalogo:
         await update.message.reply_text("⚠️ No pude encontrar ese producto en el sistema. Intenta otra búsqueda.")
         await context.bot.delete_message(chat_id=msg_temp.chat_id, message_id=msg_temp.message_id)
         return
@@ -168,7 +164,7 @@ async def recomendar_desde_historial_telegram(update, context):
     
     # 2. Obtener producto base y su información
     
-    estado["producto_base"] = df_annoy[df_annoy['product_id'] == producto_id_base].iloc[0].to_dict()
+    estado["producto_base"] = snapshot.catalogo.obtener(producto_id_base)
     nombre_base = estado["producto_base"]["productdisplayname"]
     imagen_base = estado["producto_base"].get("image_url") or "https://upload.wikimedia.org/wikipedia/commons/1/14/No_Image_Available.jpg"
     imagen_fallback = "https://upload.wikimedia.org/wikipedia/commons/1/14/No_Image_Available.jpg"
@@ -184,10 +180,7 @@ async def recomendar_desde_historial_telegram(update, context):
 Eres un asistente de moda. Un cliente ha mostrado interés en el producto: "{nombre_base}".
 Describe brevemente en 1 o 2 frases por qué este producto podría ser atractivo.
 """
-    try:
-        comentario_base = llm.invoke(prompt_desc_base).content.strip()
-    except:
-        comentario_base = "(sin descripción)"
+    comentario_base = await llamar_llm(llm, prompt_desc_base, "(sin descripción)")
 
     caption_base = f"*{nombre_base}*\n_{comentario_base}_"
     try:
@@ -218,46 +211,42 @@ Describe brevemente en 1 o 2 frases por qué este producto podría ser atractivo
         "nombre_cliente": nombre_cliente,
         "nombre_producto_base": nombre_base
     }
-    try:
-        mensaje_bienvenida = chain_recomendacion_historial.invoke(entrada_llm).content.strip()
+    mensaje_bienvenida = await llamar_llm(chain_recomendacion_historial, entrada_llm)
+    if mensaje_bienvenida:
         await update.message.reply_text(f"🤖 {mensaje_bienvenida}")
-    except Exception as e:
-        print("⚠️ Error generando mensaje LLM:", e)
         
     await context.bot.delete_message(chat_id=msg_temp.chat_id, message_id=msg_temp.message_id)
     
     # 6. Buscar productos similares con Annoy
     msg_temp = await update.message.reply_text("buscando productos similares, espere un momento...")
     
-    idx_base = reverse_id_map[producto_id_base]
-    vecinos_ids, distancias = annoy_index.get_nns_by_item(idx_base, 11, include_distances=True)
-    vecinos_filtrados = [(i, d) for i, d in zip(vecinos_ids, distancias) if product_id_map[i] != producto_id_base]
+    idx_base = snapshot.catalogo.posicion(producto_id_base)
+    vecinos_filtrados = snapshot.buscar_vecinos(idx_base, 10)
     seleccion = random.sample(vecinos_filtrados, min(5, len(vecinos_filtrados)))
 
     # 7. Preparar galería de recomendaciones
     media_group = []
     estado["productos_mostrados"] = []
 
-    for idx, dist in seleccion:
-        prod = df_annoy.iloc[idx]
-        nombre = prod["productdisplayname"]
-        imagen = prod.get("image_url") or imagen_fallback
-        sim = round(1 - dist, 3)
-
-        prompt_desc = f"""
+    productos = [snapshot.catalogo.producto(idx) for idx, _ in seleccion]
+    # Todos los comentarios a la vez: la galería tarda una llamada al LLM, no cinco
+    comentarios = await generar_textos_llm(llm, [
+        f"""
 Eres un asistente de moda. El cliente mostró interés en el producto: "{nombre_base}".
-Vas a recomendar el producto "{nombre}". Genera una frase corta (máx. 15 palabras) explicando por qué le podría gustar.
+Vas a recomendar el producto "{prod['productdisplayname']}". Genera una frase corta (máx. 15 palabras) explicando por qué le podría gustar.
 """
-        try:
-            comentario = llm.invoke(prompt_desc).content.strip()
-        except:
-            comentario = "(sin comentario)"
+        for prod in productos
+    ], "(sin comentario)")
+
+    for (idx, sim), prod, comentario in zip(seleccion, productos, comentarios):
+        nombre = prod["productdisplayname"]
+        imagen = prod["image_url"] or imagen_fallback
 
         caption = f"*{nombre}*\n_{comentario}_\n*Similitud: {sim}*"
         media_group.append(InputMediaPhoto(media=imagen, caption=caption, parse_mode="Markdown"))
 
         estado["productos_mostrados"].append({
-            "product_id": int(prod["product_id"]),
+            "product_id": prod["product_id"],
             "productdisplayname": nombre,
             "image_url": imagen
         })
@@ -294,30 +283,33 @@ Vas a recomendar el producto "{nombre}". Genera una frase corta (máx. 15 palabr
     
     # 9. Sugerencia post-recomendación
     msg_temp = await update.message.reply_text("procesando...") 
-    try:
-        mensaje_post = chain_sugerencias_post.invoke({}).content.strip()
+    mensaje_post = await llamar_llm(chain_sugerencias_post, {})
+    if mensaje_post:
         await update.message.reply_text(f"🤖 {mensaje_post}")
-    except:
+    else:
         await update.message.reply_text("¿Quieres ver el detalle de alguno o ver más similares a alguno mostrado?")
     
     await context.bot.delete_message(chat_id=msg_temp.chat_id, message_id=msg_temp.message_id)
 
 
-def obtener_contexto_columnas():
+def obtener_contexto_columnas(snapshot=None):
     """
     Devuelve un string con los valores posibles por columna de productos,
     que será usado como contexto para el LLM al validar filtros.
+
+    Sale del vocabulario del índice de atributos de la versión vigente del
+    catálogo (se renueva con cada recarga); solo se consulta PostgreSQL si el
+    índice no se pudo cargar.
     """
-    columnas = [
-        "gender", "mastercategory", "subcategory", 
-        "articletype", "basecolour", "season", "year", "usage"
-    ]
+    indice_atributos = (snapshot or catalogo_actual()).indice_atributos
+    if indice_atributos.n > 0:
+        return indice_atributos.contexto_columnas
+
     contexto = ""
-    for col in columnas:
+    for col in COLUMNAS_FILTRO:
         try:
-            valores = pd.read_sql_query(
-                f"SELECT DISTINCT {col} FROM products WHERE {col} IS NOT NULL LIMIT 100", 
-                engine
+            valores = leer_sql(
+                f"SELECT DISTINCT {col} FROM products WHERE {col} IS NOT NULL LIMIT 100"
             )[col].dropna().unique()
             contexto += f"{col}: {', '.join(map(str, valores))}\n"
         except Exception:
@@ -325,34 +317,63 @@ def obtener_contexto_columnas():
     return contexto.strip()
 
 
-def validar_y_corregir_filtros_llm(filtros_propuestos: dict) -> dict:
+# Normalizador del índice de atributos vigente; se rehace cuando cambia el snapshot
+_normalizador = (None, None)
+
+
+def normalizador_actual(snapshot=None):
+    global _normalizador
+    indice_atributos = (snapshot or catalogo_actual()).indice_atributos
+    if _normalizador[0] is not indice_atributos:
+        _normalizador = (indice_atributos, NormalizadorFiltros(indice_atributos.vocabulario))
+    return _normalizador[1]
+
+
+async def validar_y_corregir_filtros_llm(filtros_propuestos: dict, contexto_columnas=None, snapshot=None) -> dict:
     """
     Toma un conjunto de filtros (propuestos por el LLM o el usuario) y los valida
     frente a los valores reales disponibles en la base de datos.
 
-    Retorna un diccionario con los filtros corregidos.
+    Primero se corrigen localmente contra el vocabulario del catálogo
+    (NormalizadorFiltros); solo lo que no se resuelve así se manda al LLM.
+
+    Retorna un diccionario con los filtros corregidos. Desde código async conviene
+    obtener antes `contexto_columnas` con en_hilo_bd(obtener_contexto_columnas).
     """
-    contexto_columnas = obtener_contexto_columnas()
+    snapshot = snapshot or catalogo_actual()
+    corregidos, pendientes = {}, filtros_propuestos
+    if snapshot.indice_atributos.n > 0:
+        corregidos, confianza, pendientes = normalizador_actual(snapshot).normalizar(filtros_propuestos)
+        if not pendientes:
+            print(f"✅ Filtros corregidos sin LLM (confianza {confianza:.2f}):", corregidos)
+            return corregidos
+        print("🔎 Filtros sin resolver localmente, se consultan al LLM:", pendientes)
+
+    if contexto_columnas is None:
+        contexto_columnas = obtener_contexto_columnas(snapshot)
 
     try:
         entrada = {
-            "filtros_propuestos": filtros_propuestos,
+            "filtros_propuestos": pendientes,
             "contexto_columnas": contexto_columnas
         }
-        respuesta = chain_validar_filtros_llm.invoke(entrada)
-        return json.loads(respuesta.content)["filtros"]
+        respuesta = await llamar_llm(chain_validar_filtros_llm, entrada)
+        if respuesta is None:
+            return fusionar_filtros(corregidos, pendientes)
+        return fusionar_filtros(corregidos, json.loads(respuesta)["filtros"])
     except Exception as e:
         print("⚠️ Error al validar y corregir filtros con el LLM:", e)
-        return filtros_propuestos  # Devuelve tal cual si falla
+        return fusionar_filtros(corregidos, pendientes)  # Lo no resuelto se devuelve tal cual si falla
 
-def solicitar_filtros_alternativos_llm(update, filtros_actuales: dict, productos_actuales: pd.DataFrame) -> dict:
+async def solicitar_filtros_alternativos_llm(update, filtros_actuales: dict, productos_actuales: pd.DataFrame, contexto_columnas=None) -> dict:
     """
     Solicita al LLM una ampliación razonable de los filtros si los resultados son escasos.
     """
     chat_id = update.effective_chat.id
     estado = get_estado(chat_id)  
     
-    contexto_columnas = obtener_contexto_columnas()
+    if contexto_columnas is None:
+        contexto_columnas = obtener_contexto_columnas()
     
     try:
         entrada_llm = {
@@ -360,29 +381,69 @@ def solicitar_filtros_alternativos_llm(update, filtros_actuales: dict, productos
             "num_resultados": len(productos_actuales),
             "contexto_columnas": contexto_columnas
         }
-        respuesta = chain_ampliacion_filtros.invoke(entrada_llm)
-        return json.loads(respuesta.content)
+        respuesta = await llamar_llm(chain_ampliacion_filtros, entrada_llm)
+        return json.loads(respuesta) if respuesta else {}
     except Exception as e:
         print("⚠️ No se pudo obtener filtros alternativos del LLM:", e)
         return {}
 
-async def buscar_con_minimo_productos_telegram(update, context, filtros_iniciales, minimo=5, max_intentos=3):
+# Ampliador del índice de atributos vigente; se rehace cuando cambia el snapshot
+_ampliador = (None, None)
+
+
+def ampliar_filtros_local(filtros, minimo, snapshot=None):
+    """
+    (filtros, nº de productos, cambios) con la menor ampliación que llega a
+    `minimo` según los recuentos del índice de atributos, sin LLM ni base de
+    datos. `cambios` está vacío si los filtros ya bastan. None si no hay
+    índice o no se encuentra ampliación.
+    """
+    global _ampliador
+    indice_atributos = (snapshot or catalogo_actual()).indice_atributos
+    if indice_atributos.n == 0:
+        return None
+    n = indice_atributos.contar(filtros)
+    if n >= minimo:
+        return filtros, n, []
+    if _ampliador[0] is not indice_atributos:
+        _ampliador = (indice_atributos, AmpliadorFiltros(indice_atributos))
+    return _ampliador[1].ampliar(filtros, minimo)
+
+
+async def buscar_con_minimo_productos_telegram(update, context, filtros_iniciales, minimo=5, max_intentos=3, snapshot=None):
 #    global estado.estado_usuario, estado.producto_base, estado.productos_mostrados, estado.filtros_actuales
     """
     Búsqueda inteligente para Telegram:
     - Valida y corrige filtros con el LLM.
-    - Si hay pocos resultados, amplía los filtros.
+    - Si hay pocos resultados, amplía los filtros: primero localmente con los
+      recuentos del índice de atributos y, si no basta, con el LLM.
     - Muestra progreso al usuario en Telegram.
+    Todas las consultas usan la misma versión del catálogo (`snapshot`).
     """
     chat_id = update.effective_chat.id
     estado = get_estado(chat_id) 
+    snapshot = snapshot or catalogo_actual()
     
     intentos = 0
-    estado["filtros_actuales"] = validar_y_corregir_filtros_llm(filtros_iniciales)
+    # Las consultas van al executor de la base de datos para no bloquear al resto de chats
+    contexto_columnas = await en_hilo_bd(obtener_contexto_columnas, snapshot)
+    estado["filtros_actuales"] = await validar_y_corregir_filtros_llm(filtros_iniciales, contexto_columnas, snapshot)
     print("filtros_iniciales: ",filtros_iniciales)
     print("validar_y_corregir_filtros_llm: ",estado["filtros_actuales"])
+
+    # Ampliación en un paso con recuentos exactos; el bucle con el LLM queda como respaldo
+    ampliacion = await en_hilo_bd(ampliar_filtros_local, estado["filtros_actuales"], minimo, snapshot)
+    if ampliacion and ampliacion[2]:
+        n_antes = contar_productos(estado["filtros_actuales"], snapshot)
+        estado["filtros_actuales"] = ampliacion[0]
+        print(f"🧮 Filtros ampliados localmente ({n_antes} -> {ampliacion[1]}): {ampliacion[2]}")
+        await update.message.reply_text(
+            f"🤏 Solo encontré {n_antes} producto/s, así que amplié la búsqueda ({'; '.join(ampliacion[2])})."
+            if n_antes else f"🤏 No encontré productos, así que amplié la búsqueda ({'; '.join(ampliacion[2])})."
+        )
+
     while intentos < max_intentos:
-        productos = buscar_productos_en_db(estado["filtros_actuales"])
+        productos = await en_hilo_bd(buscar_productos_en_db, estado["filtros_actuales"], snapshot=snapshot)
 
         if len(productos) >= minimo:
             await update.message.reply_text(f"🎯 Encontré productos que pueden interesarte.")
@@ -398,7 +459,7 @@ async def buscar_con_minimo_productos_telegram(update, context, filtros_iniciale
             )
         intentos += 1
 
-        nuevos_datos = solicitar_filtros_alternativos_llm(update, estado["filtros_actuales"], productos)
+        nuevos_datos = await solicitar_filtros_alternativos_llm(update, estado["filtros_actuales"], productos, contexto_columnas)
         print("solicitar_filtros_alternativos",nuevos_datos)
         if nuevos_datos and "filtros" in nuevos_datos:
             estado["filtros_actuales"] = nuevos_datos["filtros"]
@@ -432,15 +493,15 @@ async def mostrar_productos_telegram(productos_df, update, context):
                 p["product_id"] = p["id"]
         media_group = []
 
-        for _, row in productos_df.iterrows():
+        # Descripciones ya generadas salen del almacén; solo las nuevas llaman al LLM
+        descripciones = await describir_productos("breve", [
+            (p["product_id"], {"nombre": p["productdisplayname"]}) for p in estado["productos_mostrados"]
+        ], "(sin descripción)")
+
+        for (_, row), descripcion in zip(productos_df.iterrows(), descripciones):
             nombre = row["productdisplayname"]
             imagen = row.get("image_url") or URL_IMAGEN_DEFAULT
 
-            try:
-                descripcion = chain_descripcion_producto.invoke({"nombre": nombre}).content.strip()
-            except:
-                descripcion = "(sin descripción)"
-
             caption = f"*{nombre}*\n{descripcion}"[:1024]
 
             media_group.append(InputMediaPhoto(media=imagen, caption=caption, parse_mode="Markdown"))
@@ -471,7 +532,7 @@ async def mostrar_productos_telegram(productos_df, update, context):
         print(f"❌ Error al enviar galería: {e}")
         await update.message.reply_text(f"❌ No se pudo mostrar la galería de productos. Error: {e}")
 
-def identificar_producto_seleccionado(update, mensaje_usuario, productos_mostrados):
+async def identificar_producto_seleccionado(update, mensaje_usuario, productos_mostrados):
 
     chat_id = update.effective_chat.id
     estado = get_estado(chat_id)
@@ -487,8 +548,10 @@ def identificar_producto_seleccionado(update, mensaje_usuario, productos_mostrad
             "productos_numerados": productos_numerados
         }
 
-        respuesta = chain_seleccion.invoke(entrada)
-        datos = json.loads(respuesta.content.strip())
+        respuesta = await llamar_llm(chain_seleccion, entrada)
+        if respuesta is None:
+            return None
+        datos = json.loads(respuesta)
 
         idx_raw = datos.get("seleccion", None)
         if idx_raw is None:
@@ -519,11 +582,49 @@ async def mostrar_detalles_producto_telegram(producto, update, context):
         "cliente_identificado": "sí" if estado.get("customer_id") else "no"
     }
 
-    try:
-        descripcion = chain_ampliar_info_producto.invoke(entrada_llm).content.strip()
-    except Exception as e:
-        descripcion = "(No se pudo generar la descripción.)"
-        print("⚠️ Error generando descripción:", e)
+    variante = entrada_llm["cliente_identificado"]
+    descripcion = almacen_descripciones.obtener("ampliada", producto["product_id"], variante)
+
+    if descripcion is None:
+        # Sin descripción guardada: se envía la foto con el nombre y el texto se va
+        # añadiendo al pie a medida que lo genera el LLM
+        try:
+            foto = await context.bot.send_photo(
+                chat_id=update.effective_chat.id,
+                photo=imagen,
+                caption=f"*{nombre}*",
+                parse_mode="Markdown"
+            )
+        except Exception as e:
+            print("❌ Error al enviar imagen:", e)
+            foto = None
+
+        if foto is not None:
+            # Los textos a medias van sin Markdown: un "_" o "*" cortado haría fallar la edición
+            async def mostrar(texto):
+                await foto.edit_caption(caption=f"{nombre}\n{texto}"[:1024])
+
+            async def mostrar_final(texto):
+                await foto.edit_caption(caption=f"*{nombre}*\n_{texto}_"[:1024], parse_mode="Markdown")
+
+            async def si_falla(texto):
+                await update.message.reply_text(f"*{nombre}*\n{texto}", parse_mode="Markdown")
+
+            await describir_producto_en_streaming(
+                "ampliada", producto["product_id"], entrada_llm, mostrar,
+                "(No se pudo generar la descripción.)", variante=variante,
+                mostrar_final=mostrar_final, si_falla=si_falla
+            )
+            return
+
+        descripcion, = await describir_productos(
+            "ampliada",
+            [(producto["product_id"], entrada_llm)],
+            "(No se pudo generar la descripción.)",
+            variante=variante
+        )
+        await update.message.reply_text(f"*{nombre}*\n{descripcion}", parse_mode="Markdown")
+        return
 
     # Enviar imagen ampliada + descripción
     try:
@@ -539,7 +640,7 @@ async def mostrar_detalles_producto_telegram(producto, update, context):
 
 
 
-async def recomendar_productos_similares_annoy_con_llm(producto_base, df_annoy, annoy_index, reverse_id_map, llm, update, context, num_total=10, num_mostrar=5):
+async def recomendar_productos_similares_annoy_con_llm(producto_base, snapshot, llm, update, context, num_total=10, num_mostrar=5, filtros=None):
 #    global estado.productos_mostrados
     try:
            
@@ -551,36 +652,42 @@ async def recomendar_productos_similares_annoy_con_llm(producto_base, df_annoy,
         estado["producto_base"] = producto_base
         producto_id = int(estado["producto_base"]["product_id"])
         nombre_base = estado["producto_base"]["productdisplayname"]
-        idx_base = reverse_id_map.get(producto_id)
+        idx_base = snapshot.catalogo.posicion(producto_id)
         
-        vecinos_ids, distancias = annoy_index.get_nns_by_item(idx_base, num_total + 1, include_distances=True)
-        vecinos_filtrados = [(i, d) for i, d in zip(vecinos_ids, distancias) if product_id_map[i] != producto_id]
+        if filtros:
+            # "Similar a este pero ...": filtros y similitud en una sola búsqueda
+            contexto_columnas = await en_hilo_bd(obtener_contexto_columnas, snapshot)
+            filtros = await validar_y_corregir_filtros_llm(filtros, contexto_columnas, snapshot)
+            vecinos_filtrados = snapshot.buscar_vecinos_con_filtros(idx_base, filtros, num_total)
+            if not vecinos_filtrados:
+                await update.message.reply_text("🤏 No encontré productos similares con esos filtros. Te muestro los más parecidos.")
+                vecinos_filtrados = snapshot.buscar_vecinos(idx_base, num_total)
+        else:
+            vecinos_filtrados = snapshot.buscar_vecinos(idx_base, num_total)
         seleccion = random.sample(vecinos_filtrados, min(5, len(vecinos_filtrados)))
     
         # 7. Preparar galería de recomendaciones
         media_group = []
         estado["productos_mostrados"] = []
     
-        for idx, dist in seleccion:
-            prod = df_annoy.iloc[idx]
-            nombre = prod["productdisplayname"]
-            imagen = prod.get("image_url") or imagen_fallback
-            sim = round(1 - dist, 3)
-    
-            prompt_desc = f"""
+        productos = [snapshot.catalogo.producto(idx) for idx, _ in seleccion]
+        comentarios = await generar_textos_llm(llm, [
+            f"""
     Eres un asistente de moda. El cliente mostró interés en el producto: "{nombre_base}".
-    Vas a recomendar el producto "{nombre}". Genera una frase corta (máx. 15 palabras) explicando por qué le podría gustar.
+    Vas a recomendar el producto "{prod['productdisplayname']}". Genera una frase corta (máx. 15 palabras) explicando por qué le podría gustar.
     """
-            try:
-                comentario = llm.invoke(prompt_desc).content.strip()
-            except:
-                comentario = "(sin comentario)"
+            for prod in productos
+        ], "(sin comentario)")
+    
+        for (idx, sim), prod, comentario in zip(seleccion, productos, comentarios):
+            nombre = prod["productdisplayname"]
+            imagen = prod["image_url"] or URL_IMAGEN_DEFAULT
     
             caption = f"*{nombre}*\n_{comentario}_\n*Similitud: {sim}*"
             media_group.append(InputMediaPhoto(media=imagen, caption=caption, parse_mode="Markdown"))
     
             estado["productos_mostrados"].append({
-                "product_id": int(prod["product_id"]),
+                "product_id": prod["product_id"],
                 "productdisplayname": nombre,
                 "image_url": imagen
             })
@@ -617,10 +724,10 @@ async def recomendar_productos_similares_annoy_con_llm(producto_base, df_annoy,
 
         # 9. Sugerencia post-recomendación
         msg_temp = await update.message.reply_text("procesando...") 
-        try:
-            mensaje_post = chain_sugerencias_post.invoke({}).content.strip()
+        mensaje_post = await llamar_llm(chain_sugerencias_post, {})
+        if mensaje_post:
             await update.message.reply_text(f"🤖 {mensaje_post}")
-        except:
+        else:
             await update.message.reply_text("¿Quieres ver el detalle de alguno o ver más similares a alguno mostrado?")
         
         await context.bot.delete_message(chat_id=msg_temp.chat_id, message_id=msg_temp.message_id)
@@ -631,4 +738,4 @@ async def recomendar_productos_similares_annoy_con_llm(producto_base, df_annoy,
 
 
 # Exportar elementos clave para usar en otros módulos
-__all__ = ["df_annoy", "annoy_index", "product_id_map", "reverse_id_map", "obtener_recomendaciones_similares", "obtener_producto_base", "recomendar_desde_historial_telegram","buscar_con_minimo_productos_telegram","mostrar_productos_telegram","identificar_producto_seleccionado","mostrar_detalles_producto_telegram","recomendar_productos_similares_annoy_con_llm"]
+__all__ = ["gestor_catalogo", "catalogo_actual", "cache_busquedas", "buscar_similares_filtrados", "buscar_productos_en_db", "contar_productos", "obtener_recomendaciones_similares", "obtener_producto_base", "recomendar_desde_historial_telegram","buscar_con_minimo_productos_telegram","mostrar_productos_telegram","identificar_producto_seleccionado","mostrar_detalles_producto_telegram","recomendar_productos_similares_annoy_con_llm"]
@@ -1,10 +1,13 @@
 from langchain_core.prompts import PromptTemplate
 from langchain_core.runnables import RunnableSequence
 from langchain_openai import ChatOpenAI
-from app.config import OPENAI_API_KEY
+from app.config import OPENAI_API_KEY, LLM_TIMEOUT_S, LLM_MAX_REINTENTOS
 
 # 🔹 Inicializar LLM
-llm = ChatOpenAI(model="gpt-4.1", temperature=0.5, openai_api_key=OPENAI_API_KEY)
+llm = ChatOpenAI(
+    model="gpt-4.1", temperature=0.5, openai_api_key=OPENAI_API_KEY,
+    timeout=LLM_TIMEOUT_S, max_retries=LLM_MAX_REINTENTOS
+)
 
 # 🔸 1. Prompt para descripción breve de producto
 prompt_descripcion_producto = PromptTemplate.from_template("""
@@ -111,16 +114,23 @@ Eres un asistente inteligente de moda que interpreta la intención del usuario b
 
 Tu objetivo es determinar la intención general del usuario entre las siguientes opciones:
 
+- "saludo": si el mensaje es solo un saludo (hola, buenos días, hey...).
 - "identificar": si el usuario está diciendo su número de cliente.
 - "buscar": si está pidiendo ver nuevos productos (por tipo, color, uso...).
 - "detalle": si quiere más información sobre un producto mostrado.
-- "similares": si quiere ver productos parecidos a uno mostrado.
+- "similares": si quiere ver productos parecidos a uno mostrado. Si además pide alguna característica (ej. "como el segundo pero en negro"), incluye esos filtros en "detalles" igual que en "buscar".
 - "reiniciar": si quiere reiniciar la conversación.
 - "nada": si no se detecta ninguna intención clara o relacionada con moda.
 
+En "detalles" incluye solo lo que corresponda:
+- "filtros": para "buscar" y "similares", columnas y valores del catálogo.
+- "customer_id": para "identificar", el número de cliente como entero (omítelo si no lo dice).
+- "seleccion": para "detalle" y "similares", la posición (1, 2, 3...) del producto mostrado al que se refiere, si se puede saber.
+- "respuesta": para "saludo", un saludo de máximo 2 frases. Si el cliente está identificado salúdalo por su nombre y sugiérele explorar productos o ver algo similar; si no, sugiere que puede identificarse para recibir recomendaciones personalizadas.
+
 ### Instrucciones de formato
 
-Responde en formato JSON estructurado **sin ningún texto adicional**, como este ejemplo:
+Responde en formato JSON estructurado **sin ningún texto adicional**, como estos ejemplos:
 
 {{
   "accion": "buscar",
@@ -132,6 +142,14 @@ Responde en formato JSON estructurado **sin ningún texto adicional**, como este
   }}
 }}
 
+{{
+  "accion": "similares",
+  "detalles": {{
+    "seleccion": 2,
+    "filtros": {{ "basecolour": "Black" }}
+  }}
+}}
+
 ### Contexto actual
 
 Cliente identificado: "{cliente_nombre}"
@@ -0,0 +1,204 @@
+import re
+import unicodedata
+
+import numpy as np
+
+from app.config import ROUTER_UMBRAL, ROUTER_MAX_PALABRAS
+
+# --- Enrutado local de intenciones: reglas + clasificador pequeño, sin LLM ---
+
+
+def normalizar_texto(texto):
+    """Minúsculas y sin tildes ("Enséñame" -> "ensename")."""
+    texto = unicodedata.normalize("NFKD", texto.lower())
+    return "".join(c for c in texto if not unicodedata.combining(c)).strip()
+
+
+def _contiene(texto, palabras):
+    """True si alguna palabra o frase aparece completa en el texto normalizado ("id" no está en "vestidos")."""
+    return re.search(r"\b(?:" + "|".join(map(re.escape, palabras)) + r")\b", texto) is not None
+
+
+# ➕ función: detectar intención general (simplificada)
+def detectar_intencion_simple(mensaje_usuario):
+    mensaje = normalizar_texto(mensaje_usuario)
+
+    if _contiene(mensaje, ["cliente", "soy", "id"]):
+        return "identificar"
+    if _contiene(mensaje, ["ver", "mostrar", "buscar", "ensename"]):
+        return "buscar"
+    if _contiene(mensaje, ["similares"]):
+        return "similares"
+    if _contiene(mensaje, ["mas info", "detalles", "quiero saber"]):
+        return "detalle"
+    if _contiene(mensaje, ["reiniciar"]):
+        return "reiniciar"
+    return "nada"
+
+
+# --- Reglas
+
+PATRON_SALUDO = re.compile(
+    r"^(hola|holi|buenas|buenos dias|buenas tardes|buenas noches|hey|hi|hello|saludos|que tal)"
+    r"( que tal)?[\s!.,¡]*$"
+)
+PATRON_REINICIAR = re.compile(r"^(reiniciar|reinicia|reinicio|reset|empezar de nuevo|volver a empezar)[\s!.]*$")
+PATRON_ID_CLIENTE = re.compile(
+    r"^(?:hola[\s,!]*)?(?:soy (?:el )?(?:cliente )?|cliente (?:n(?:umero|o|º|°)?\.? ?)?|mi id es |id:? ?|mi numero de cliente es )(\d+)[\s!.]*$"
+)
+
+ORDINALES = {
+    "primero": 1, "primera": 1, "primer": 1,
+    "segundo": 2, "segunda": 2,
+    "tercero": 3, "tercera": 3, "tercer": 3,
+    "cuarto": 4, "cuarta": 4,
+    "quinto": 5, "quinta": 5,
+    "ultimo": -1, "ultima": -1,
+}
+PATRON_ORDINAL = re.compile(r"\b(" + "|".join(ORDINALES) + r")\b")
+PATRON_NUMERO_PRODUCTO = re.compile(r"\b(?:el|la|del|al|numero|n(?:o|º|°)\.?)\s*(\d)\b")
+# Solo la referencia al producto ("el segundo", "3"): se entiende como petición de detalle
+PATRON_SOLO_SELECCION = re.compile(r"^(?:el |la |numero )?(?:" + "|".join(ORDINALES) + r"|\d)[\s!.]*$")
+
+
+def extraer_seleccion(texto, n_mostrados):
+    """Posición (1..n) del producto mostrado al que se refiere el texto normalizado, o None."""
+    if n_mostrados == 0:
+        return None
+    m = PATRON_ORDINAL.search(texto)
+    if m:
+        posicion = ORDINALES[m.group(1)]
+    else:
+        m = PATRON_NUMERO_PRODUCTO.search(texto)
+        if not m:
+            return None
+        posicion = int(m.group(1))
+    if posicion == -1:
+        posicion = n_mostrados
+    return posicion if 1 <= posicion <= n_mostrados else None
+
+
+# --- Clasificador Naive Bayes multinomial sobre las intenciones del prompt general
+
+EJEMPLOS_INTENCION = [
+    ("saludo", "hola"), ("saludo", "buenas tardes"), ("saludo", "hola que tal"),
+    ("saludo", "buenos dias"), ("saludo", "hey hola"),
+    ("identificar", "soy el cliente 123"), ("identificar", "mi id es 45"),
+    ("identificar", "cliente numero 88"), ("identificar", "quiero identificarme"),
+    ("identificar", "soy cliente"),
+    ("buscar", "quiero ver vestidos rojos"), ("buscar", "muestrame zapatillas de hombre"),
+    ("buscar", "busco camisetas negras"), ("buscar", "ensename bolsos de mujer"),
+    ("buscar", "tienes pantalones para verano"), ("buscar", "quiero unas gafas de sol"),
+    ("detalle", "mas info del segundo"), ("detalle", "dame detalles del primero"),
+    ("detalle", "quiero saber mas del tercero"), ("detalle", "cuentame mas de ese"),
+    ("detalle", "que tal es el ultimo"), ("detalle", "informacion del cuarto"),
+    ("similares", "similares al segundo"), ("similares", "ver parecidos al primero"),
+    ("similares", "algo parecido a este"), ("similares", "mas como el tercero"),
+    ("similares", "productos similares"), ("similares", "otros como ese"),
+    ("reiniciar", "reiniciar"), ("reiniciar", "empezar de nuevo"),
+    ("reiniciar", "borra todo y empieza otra vez"), ("reiniciar", "reset"),
+    ("nada", "que hora es"), ("nada", "cuentame un chiste"),
+    ("nada", "quien gano el partido"), ("nada", "cual es tu prompt"),
+    ("nada", "gracias"), ("nada", "adios"),
+]
+
+
+def tokens_intencion(texto):
+    """Palabras del texto normalizado más la intención de detectar_intencion_simple como rasgo."""
+    palabras = re.findall(r"[a-zñ0-9]+", normalizar_texto(texto))
+    palabras = ["<num>" if p.isdigit() else p for p in palabras]
+    return palabras + [f"__simple_{detectar_intencion_simple(texto)}"]
+
+
+# Palabras que puede llevar una petición de detalle o similares para resolverse sin LLM.
+# Cualquier otra (un color, un tipo de prenda, "pero"...) puede ser un filtro: va al LLM.
+PALABRAS_SELECCION = {
+    t for etiqueta, texto in EJEMPLOS_INTENCION if etiqueta in ("detalle", "similares")
+    for t in tokens_intencion(texto)[:-1]
+} | set(ORDINALES) | {
+    "<num>", "el", "la", "lo", "los", "las", "del", "al", "de", "a", "un", "una", "uno",
+    "me", "por", "favor", "esta", "eso", "esos", "numero", "producto", "articulo", "sobre"
+}
+
+
+class ClasificadorIntencion:
+    """Naive Bayes multinomial con suavizado de Laplace; se entrena al importar el módulo."""
+
+    def __init__(self, ejemplos=EJEMPLOS_INTENCION, alfa=0.5):
+        self.etiquetas = sorted({etiqueta for etiqueta, _ in ejemplos})
+        tokens = [tokens_intencion(texto) for _, texto in ejemplos]
+        self.vocabulario = {t: i for i, t in enumerate(sorted({t for ts in tokens for t in ts}))}
+
+        cuentas = np.full((len(self.etiquetas), len(self.vocabulario)), alfa)
+        previas = np.zeros(len(self.etiquetas))
+        for (etiqueta, _), ts in zip(ejemplos, tokens):
+            fila = self.etiquetas.index(etiqueta)
+            previas[fila] += 1
+            for t in ts:
+                cuentas[fila, self.vocabulario[t]] += 1
+        self.log_previas = np.log(previas / previas.sum())
+        self.log_verosimilitud = np.log(cuentas / cuentas.sum(axis=1, keepdims=True))
+
+    def predecir(self, texto):
+        """(intención, probabilidad) más probable; las palabras desconocidas se ignoran."""
+        columnas = [self.vocabulario[t] for t in tokens_intencion(texto) if t in self.vocabulario]
+        log_post = self.log_previas + self.log_verosimilitud[:, columnas].sum(axis=1)
+        probabilidades = np.exp(log_post - log_post.max())
+        probabilidades /= probabilidades.sum()
+        k = int(np.argmax(probabilidades))
+        return self.etiquetas[k], float(probabilidades[k])
+
+
+clasificador_intencion = ClasificadorIntencion()
+
+
+def enrutar_mensaje(mensaje_usuario, estado, umbral=ROUTER_UMBRAL):
+    """
+    Decide la acción sin LLM cuando no hay ambigüedad. Devuelve un dict con el
+    mismo formato que chain_interpretacion_general ({"accion", "detalles"}) o
+    None si el mensaje debe ir al LLM.
+
+    Solo se resuelven localmente saludos, reinicios, identificaciones con número
+    y peticiones de detalle o similares sin filtros; las búsquedas necesitan
+    que el LLM extraiga los filtros.
+    """
+    texto = normalizar_texto(mensaje_usuario)
+    n_mostrados = len(estado.get("productos_mostrados") or [])
+
+    if PATRON_SALUDO.match(texto):
+        return {"accion": "saludo", "detalles": {}}
+    if PATRON_REINICIAR.match(texto):
+        return {"accion": "reiniciar", "detalles": {}}
+    m = PATRON_ID_CLIENTE.match(texto)
+    if m:
+        return {"accion": "identificar", "detalles": {"customer_id": int(m.group(1))}}
+
+    if PATRON_SOLO_SELECCION.match(texto):
+        seleccion = extraer_seleccion(texto if not texto[:1].isdigit() else f"el {texto}", n_mostrados)
+        if seleccion is not None:
+            return {"accion": "detalle", "detalles": {"seleccion": seleccion}}
+
+    # Mensajes largos pueden llevar filtros ("como el segundo pero en negro"): al LLM
+    if len(texto.split()) > ROUTER_MAX_PALABRAS:
+        return None
+
+    accion, probabilidad = clasificador_intencion.predecir(mensaje_usuario)
+    if probabilidad < umbral:
+        return None
+    if accion in ("saludo", "reiniciar"):
+        return {"accion": accion, "detalles": {}}
+    if accion in ("detalle", "similares"):
+        if any(t not in PALABRAS_SELECCION for t in tokens_intencion(mensaje_usuario)[:-1]):
+            return None
+        seleccion = extraer_seleccion(texto, n_mostrados)
+        if seleccion is not None:
+            return {"accion": accion, "detalles": {"seleccion": seleccion}}
+        if accion == "similares" and estado.get("producto_base") and n_mostrados == 0:
+            return {"accion": accion, "detalles": {}}
+    return None
+
+
+__all__ = [
+    "normalizar_texto", "detectar_intencion_simple", "extraer_seleccion",
+    "ClasificadorIntencion", "clasificador_intencion", "enrutar_mensaje"
+]
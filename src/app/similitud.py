@@ -0,0 +1,171 @@
+import numpy as np
+
+from app.config import SIMILARITY_BACKEND, ANNOY_SEARCH_K
+
+# Filas por lote en la búsqueda exacta (lote x n_productos float32 en memoria)
+TAM_LOTE_EXACTO = 256
+
+# Búsqueda con filtros: hasta este número de candidatos se puntúan todos de forma exacta
+MAX_CANDIDATOS_EXACTO = 20000
+SOBREMUESTREO_FILTRADO = 10
+
+
+def _similitud_angular(distancia):
+    """Annoy devuelve la distancia angular sqrt(2 - 2·cos): la pasamos a coseno."""
+    return 1.0 - (distancia * distancia) / 2.0
+
+
+def mejores_similitudes(sims, posiciones, n):
+    """Las n mayores similitudes como [(posicion, similitud)] de mayor a menor."""
+    k = min(n, len(sims))
+    if k <= 0:
+        return []
+    top = np.argpartition(-sims, k - 1)[:k]
+    top = top[np.argsort(-sims[top])]
+    return [(int(posiciones[j]), round(float(sims[j]), 3)) for j in top]
+
+
+class MotorSimilitud:
+    """
+    Interfaz común de los motores de similitud. Los productos se identifican
+    por su posición en el catálogo y las similitudes son cosenos.
+    """
+    nombre = "base"
+
+    def n_items(self):
+        raise NotImplementedError
+
+    def vecinos(self, pos, n):
+        """Hasta n (posicion, similitud) del producto en `pos`, sin él mismo, de mayor a menor similitud."""
+        raise NotImplementedError
+
+    def vecinos_por_vector(self, vector, n):
+        """Hasta n (posicion, similitud) de un vector normalizado que no está en el índice."""
+        raise NotImplementedError
+
+    def vecinos_lote(self, posiciones, k):
+        """
+        Vecinos de varios productos a la vez. Devuelve (vecinos, similitudes),
+        ambos [len(posiciones), k], con -1 donde no hay vecino.
+        """
+        vecinos = np.full((len(posiciones), k), -1, dtype=np.int32)
+        similitudes = np.zeros((len(posiciones), k), dtype=np.float32)
+        for fila, pos in enumerate(posiciones):
+            resultado = self.vecinos(int(pos), k)
+            if resultado:
+                vecinos[fila, :len(resultado)] = [i for i, _ in resultado]
+                similitudes[fila, :len(resultado)] = [sim for _, sim in resultado]
+        return vecinos, similitudes
+
+
+class MotorAnnoy(MotorSimilitud):
+    """Búsqueda aproximada sobre el índice Annoy."""
+    nombre = "annoy"
+
+    def __init__(self, annoy_index, search_k=ANNOY_SEARCH_K):
+        self.annoy_index = annoy_index
+        self.search_k = search_k
+
+    def n_items(self):
+        return self.annoy_index.get_n_items()
+
+    def vecinos(self, pos, n):
+        ids, distancias = self.annoy_index.get_nns_by_item(pos, n + 1, search_k=self.search_k, include_distances=True)
+        return [(i, round(_similitud_angular(d), 3)) for i, d in zip(ids, distancias) if i != pos][:n]
+
+    def vecinos_por_vector(self, vector, n):
+        ids, distancias = self.annoy_index.get_nns_by_vector(vector, n, search_k=self.search_k, include_distances=True)
+        return [(i, round(_similitud_angular(d), 3)) for i, d in zip(ids, distancias)]
+
+
+class MotorExacto(MotorSimilitud):
+    """
+    Búsqueda exacta por fuerza bruta: producto matricial contra la
+    MatrizFeatures (coseno, en float32, float16 o int8) y argpartition para el
+    top-k. Recall perfecto respecto a los vectores almacenados.
+    """
+    nombre = "exacto"
+
+    def __init__(self, features):
+        self.features = features
+
+    def n_items(self):
+        return len(self.features)
+
+    def _top_k(self, puntuaciones, k):
+        """Índices de las k mayores puntuaciones de cada fila, ordenados."""
+        k = min(k, puntuaciones.shape[1])
+        candidatos = np.argpartition(-puntuaciones, k - 1, axis=1)[:, :k]
+        orden = np.argsort(-np.take_along_axis(puntuaciones, candidatos, axis=1), axis=1)
+        return np.take_along_axis(candidatos, orden, axis=1)
+
+    def vecinos_lote(self, posiciones, k):
+        posiciones = np.asarray(posiciones, dtype=np.int64)
+        vecinos = np.full((len(posiciones), k), -1, dtype=np.int32)
+        similitudes = np.zeros((len(posiciones), k), dtype=np.float32)
+        if self.n_items() <= 1 or len(posiciones) == 0:
+            return vecinos, similitudes
+
+        for inicio in range(0, len(posiciones), TAM_LOTE_EXACTO):
+            lote = posiciones[inicio:inicio + TAM_LOTE_EXACTO]
+            puntuaciones = self.features.similitudes(self.features.filas(lote))
+            # El propio producto nunca es vecino de sí mismo
+            puntuaciones[np.arange(len(lote)), lote] = -np.inf
+            top = self._top_k(puntuaciones, k)
+            sims = np.take_along_axis(puntuaciones, top, axis=1)
+            top[np.isneginf(sims)] = -1
+            m = top.shape[1]
+            vecinos[inicio:inicio + len(lote), :m] = top
+            similitudes[inicio:inicio + len(lote), :m] = np.where(top >= 0, sims, 0.0)
+        return vecinos, similitudes
+
+    def vecinos(self, pos, n):
+        vecinos, similitudes = self.vecinos_lote([pos], n)
+        return [(int(i), round(float(s), 3)) for i, s in zip(vecinos[0], similitudes[0]) if i >= 0]
+
+    def vecinos_por_vector(self, vector, n):
+        sims = self.features.similitudes(vector)[0]
+        return mejores_similitudes(sims, np.arange(len(sims)), n)
+
+
+def vecinos_filtrados(motor, features, pos, permitidos, n, sobremuestreo=SOBREMUESTREO_FILTRADO, vector=None):
+    """
+    Hasta n (posicion, similitud) del producto en `pos` entre las posiciones
+    del índice con `permitidos[i] == True`. Para un producto que no está en el
+    índice se pasa pos=None y su `vector`.
+
+    Si hay pocos candidatos se puntúan todos de forma exacta (pre-filtrado);
+    si hay muchos se piden n * sobremuestreo vecinos al motor y se filtran
+    (post-filtrado), volviendo al exacto si no quedan suficientes.
+    """
+    permitidos = permitidos[:len(features)]
+    candidatos = np.flatnonzero(permitidos)
+    if pos is not None:
+        candidatos = candidatos[candidatos != pos]
+    if len(candidatos) == 0:
+        return []
+
+    if len(candidatos) > MAX_CANDIDATOS_EXACTO and not isinstance(motor, MotorExacto):
+        if pos is not None:
+            vecinos = motor.vecinos(pos, n * sobremuestreo)
+        else:
+            vecinos = motor.vecinos_por_vector(vector, n * sobremuestreo)
+        vecinos = [(i, sim) for i, sim in vecinos if permitidos[i]]
+        if len(vecinos) >= n:
+            return vecinos[:n]
+
+    consulta = features.filas([pos]) if pos is not None else vector
+    sims = features.similitudes(consulta, posiciones=candidatos)[0]
+    return mejores_similitudes(sims, candidatos, n)
+
+
+def crear_motor(annoy_index, features, nombre=SIMILARITY_BACKEND):
+    """Crea el motor configurado en SIMILARITY_BACKEND."""
+    if nombre == MotorExacto.nombre:
+        return MotorExacto(features)
+    if nombre != MotorAnnoy.nombre:
+        print(f"⚠️ Motor de similitud desconocido '{nombre}'; se usará Annoy")
+    return MotorAnnoy(annoy_index)
+
+
+__all__ = ["MotorSimilitud", "MotorAnnoy", "MotorExacto", "mejores_similitudes", "vecinos_filtrados", "crear_motor"]
@@ -0,0 +1,328 @@
+import threading
+import itertools
+from datetime import datetime
+
+import numpy as np
+
+from app.indice import cargar_o_construir_indice, cargar_indice_persistido, leer_meta_indice
+from app.archivo_catalogo import huella_productos, exportar_catalogo, cargar_catalogo_exportado
+from app.catalogo import CatalogoProductos
+from app.vecinos import cargar_tabla_vecinos, calcular_tabla_vecinos, guardar_tabla_vecinos
+from app.similitud import crear_motor, vecinos_filtrados
+from app.atributos import IndiceAtributos, leer_atributos, leer_atributos_nuevos, cargar_indice_atributos
+from app.historial import cargar_historial
+from app.delta import DeltaProductos, fusionar_vecinos, cargar_productos_nuevos
+from app.config import DELTA_MAX_ITEMS
+
+_contador_versiones = itertools.count(1)
+
+
+class SnapshotCatalogo:
+    """
+    Versión inmutable del catálogo: productos, índice, motor de similitud,
+    vecinos precalculados, índice de atributos e historial de clientes. Un mensaje usa la misma
+    versión de principio a fin aunque entretanto se publique otra.
+
+    Los productos añadidos después de construir el índice van en `delta`, a
+    continuación de los del índice principal, y se buscan de forma exacta.
+    """
+
+    def __init__(self, catalogo, annoy_index, motor, tabla_vecinos, indice_atributos, feature_cols, huella=None, delta=None, historial=None):
+        self.version = next(_contador_versiones)
+        self.huella = huella
+        self.creado = datetime.now()
+        self.catalogo = catalogo
+        self.annoy_index = annoy_index
+        self.motor = motor
+        self.tabla_vecinos = tabla_vecinos
+        self.indice_atributos = indice_atributos
+        self.feature_cols = feature_cols
+        self.delta = delta
+        self.historial = historial
+
+    @property
+    def n_principal(self):
+        """Productos del índice principal (posiciones 0..n_principal-1)."""
+        return self.motor.n_items()
+
+    def descripcion(self):
+        n_delta = len(self.delta) if self.delta else 0
+        return (
+            f"v{self.version} ({self.creado:%Y-%m-%d %H:%M:%S}): {self.n_principal} productos indexados "
+            f"+ {n_delta} nuevos, {self.indice_atributos.n} filtrables, motor {self.motor.nombre}"
+        )
+
+    def _vector(self, pos):
+        if self.delta and self.delta.contiene(pos):
+            return self.delta.vector(pos)
+        return self.catalogo.features.filas([pos])[0]
+
+    def con_delta(self, df_nuevos, matriz, indice_atributos=None):
+        """Nueva versión con los productos de `df_nuevos` como delta (sustituye al delta anterior)."""
+        n = self.n_principal
+        catalogo = CatalogoProductos(
+            np.concatenate([self.catalogo.ids[:n], df_nuevos["product_id"].to_numpy(dtype=np.int64)]),
+            list(self.catalogo.nombres[:n]) + df_nuevos["productdisplayname"].tolist(),
+            list(self.catalogo.imagenes[:n]) + df_nuevos["image_url"].tolist(),
+            features=self.catalogo.features
+        )
+        delta = DeltaProductos(n, df_nuevos["product_id"], matriz)
+        return SnapshotCatalogo(
+            catalogo, self.annoy_index, self.motor, self.tabla_vecinos,
+            indice_atributos or self.indice_atributos, self.feature_cols, self.huella, delta, self.historial
+        )
+
+    def con_tabla_vecinos(self, tabla_vecinos):
+        """Nueva versión igual a esta con otra tabla de vecinos precalculados."""
+        return SnapshotCatalogo(
+            self.catalogo, self.annoy_index, self.motor, tabla_vecinos, self.indice_atributos,
+            self.feature_cols, self.huella, self.delta, self.historial
+        )
+
+    def buscar_vecinos(self, idx_base, n):
+        """
+        Devuelve hasta n (posicion, similitud) del producto en `idx_base`, sin él mismo.
+        Usa la tabla precalculada y solo recurre al motor de similitud en vivo para
+        productos que no están en ella.
+        """
+        if idx_base >= self.n_principal:
+            vecinos = self.motor.vecinos_por_vector(self._vector(idx_base), n)
+        elif self.tabla_vecinos is not None and self.tabla_vecinos.cubre(idx_base, n):
+            vecinos = self.tabla_vecinos.vecinos(idx_base, n)
+        else:
+            vecinos = self.motor.vecinos(idx_base, n)
+
+        # Los productos nuevos aún no están en el índice: se puntúan aparte y se mezclan
+        if self.delta:
+            vecinos = fusionar_vecinos(vecinos, self.delta.vecinos(self._vector(idx_base), n, excluir=idx_base), n)
+        return vecinos
+
+    def buscar_vecinos_con_filtros(self, idx_base, filtros, n):
+        """
+        Hasta n (posicion, similitud) similares al producto en `idx_base` que
+        cumplen `filtros` (mismo formato que buscar_productos_en_db).
+        """
+        ids_permitidos = self.indice_atributos.ids_filtrados(filtros)
+        posiciones = self.catalogo.posiciones(ids_permitidos)
+        permitidos = np.zeros(len(self.catalogo), dtype=bool)
+        permitidos[posiciones[posiciones >= 0]] = True
+
+        vecinos = None
+        if idx_base >= self.n_principal:
+            vecinos = vecinos_filtrados(self.motor, self.catalogo.features, None, permitidos, n, vector=self._vector(idx_base))
+        else:
+            # Primero los vecinos precalculados; si no bastan, búsqueda filtrada en el motor
+            tabla = self.tabla_vecinos
+            if tabla is not None and tabla.cubre(idx_base, tabla.k):
+                vecinos = [(i, sim) for i, sim in tabla.vecinos(idx_base, tabla.k) if permitidos[i]][:n]
+                if len(vecinos) < n:
+                    vecinos = None
+            if vecinos is None:
+                vecinos = vecinos_filtrados(self.motor, self.catalogo.features, idx_base, permitidos, n)
+
+        if self.delta:
+            delta = self.delta.vecinos(self._vector(idx_base), n, permitidos=permitidos, excluir=idx_base)
+            vecinos = fusionar_vecinos(vecinos, delta, n)
+        return vecinos
+
+    def buscar_similares_filtrados(self, filtros, producto_id_base=None, n=10):
+        """
+        Búsqueda en un solo paso: productos que cumplen los filtros, ordenados por
+        similitud con el producto base si se indica (p. ej. "como este pero en negro").
+
+        Devuelve un DataFrame con product_id, productdisplayname, image_url y,
+        si hay producto base, similitud.
+        """
+        filtros = filtros or {}
+        idx_base = self.catalogo.posicion(producto_id_base) if producto_id_base is not None else None
+        if idx_base is None:
+            return self.indice_atributos.buscar(filtros, limit=n)
+
+        vecinos = self.buscar_vecinos_con_filtros(idx_base, filtros, n)
+        df = self.catalogo.a_dataframe([i for i, _ in vecinos])
+        df["similitud"] = [sim for _, sim in vecinos]
+        return df
+
+
+def cargar_snapshot(desde_archivo=False):
+    """
+    Carga una versión completa del catálogo.
+
+    Con desde_archivo=True (arranque) usa el catálogo Parquet y el índice
+    persistidos sin tocar PostgreSQL, si ambos existen y son de la misma huella.
+    Si no (o si products ha cambiado desde la exportación), o en una recarga,
+    lee products, comprueba la huella del índice (reconstruyéndolo si el
+    catálogo ha cambiado) y vuelve a exportar el catálogo.
+    """
+    df_productos = cargar_catalogo_exportado() if desde_archivo else None
+    indice = cargar_indice_persistido() if df_productos is not None else None
+
+    if indice is None:
+        # Huella antes de leer: un cambio durante la lectura obliga a exportar de nuevo
+        try:
+            huella = huella_productos()
+        except Exception as e:
+            print("⚠️ No se pudo calcular la huella de products:", e)
+            huella = None
+        df_productos = leer_atributos()
+        print(f"✅ Datos de productos cargados: {len(df_productos)} registros")
+        # --- Índice Annoy persistido (o construido si el catálogo ha cambiado)
+        indice = cargar_o_construir_indice()
+        if len(df_productos) and huella is not None:
+            try:
+                exportar_catalogo(df_productos, huella)
+            except Exception as e:
+                print("⚠️ No se pudo exportar el catálogo:", e)
+
+    annoy_index, ids_indice, feature_cols, features = indice
+    df_productos = df_productos.drop_duplicates(subset="product_id")
+
+    # Catálogo en columnas: la posición de cada producto es el id del item en Annoy
+    df_catalogo = (
+        df_productos.set_index("product_id")[["productdisplayname", "image_url"]]
+        .reindex(ids_indice).rename_axis("product_id").reset_index()
+    )
+    catalogo = CatalogoProductos.desde_dataframe(df_catalogo, features=features)
+    del df_catalogo
+    print(f"✅ Índice Annoy listo con {annoy_index.get_n_items()} productos")
+
+    # --- Motor de similitud configurado (SIMILARITY_BACKEND)
+    motor = crear_motor(annoy_index, features)
+    print(f"✅ Motor de similitud: {motor.nombre}")
+
+    # --- Vecinos precalculados (tareas.py vecinos); sin tabla se consulta el motor en vivo
+    tabla_vecinos = cargar_tabla_vecinos(motor.n_items())
+
+    # --- Bitmaps de atributos de products: búsquedas y conteos sin pasar por PostgreSQL
+    indice_atributos = cargar_indice_atributos(df_productos)
+    del df_productos
+
+    # --- Historial por cliente precalculado (tareas.py historial)
+    historial = cargar_historial()
+
+    huella = (leer_meta_indice() or {}).get("huella")
+    return SnapshotCatalogo(catalogo, annoy_index, motor, tabla_vecinos, indice_atributos, feature_cols, huella, historial=historial)
+
+
+class GestorCatalogo:
+    """
+    Mantiene la versión vigente del catálogo. Una recarga construye la nueva
+    versión aparte y la publica con una sola asignación; quien ya tenía la
+    versión anterior termina con ella.
+    """
+
+    def __init__(self, cargador=cargar_snapshot):
+        self._cargador = cargador
+        self._actual = None
+        self._lock_recarga = threading.Lock()
+
+    def actual(self):
+        return self._actual
+
+    def cargar(self):
+        """Carga inicial, bloqueante. Parte de los artefactos en disco si están al día."""
+        self._actual = self._cargador(desde_archivo=True)
+        return self._actual
+
+    def recargar(self):
+        """
+        Construye una nueva versión y la publica. Devuelve la nueva versión o
+        None si ya había una recarga en curso o si falló (se mantiene la actual).
+        """
+        if not self._lock_recarga.acquire(blocking=False):
+            print("⚠️ Ya hay una recarga del catálogo en curso")
+            return None
+        try:
+            print("🔄 Recargando catálogo...")
+            nuevo = self._cargador()
+            anterior, self._actual = self._actual, nuevo
+            print(f"✅ Catálogo recargado: {nuevo.descripcion()} (antes v{anterior.version if anterior else '-'})")
+            return nuevo
+        except Exception as e:
+            print("❌ Error recargando el catálogo; se mantiene la versión actual:", e)
+            return None
+        finally:
+            self._lock_recarga.release()
+
+    def actualizar_delta(self, max_items=DELTA_MAX_ITEMS):
+        """
+        Incorpora como delta los productos añadidos desde la última construcción
+        del índice. Si el delta supera `max_items`, lanza una reconstrucción
+        completa (compactación) que los integra en el índice principal.
+        """
+        if not self._lock_recarga.acquire(blocking=False):
+            return None
+        compactar = False
+        try:
+            actual = self._actual
+            n = actual.n_principal
+            max_id = int(actual.catalogo.ids[:n].max()) if n else -1
+            df_nuevos, matriz = cargar_productos_nuevos(max_id, actual.feature_cols)
+
+            ids_delta = actual.delta.ids if actual.delta else np.empty(0, dtype=np.int64)
+            if np.array_equal(df_nuevos["product_id"].to_numpy(dtype=np.int64), ids_delta):
+                return None
+
+            if len(df_nuevos) > max_items:
+                compactar = True
+            else:
+                # Los productos nuevos también tienen que poder filtrarse: solo se leen
+                # las filas de products posteriores al índice de atributos actual
+                indice_atributos = actual.indice_atributos
+                max_id_atributos = int(indice_atributos.ids.max()) if indice_atributos.n else -1
+                df_atributos = leer_atributos_nuevos(max_id_atributos)
+                if len(df_atributos):
+                    indice_atributos = IndiceAtributos(df_atributos, base=indice_atributos)
+                self._actual = actual.con_delta(df_nuevos, matriz, indice_atributos)
+                print(f"➕ Delta actualizado: {self._actual.descripcion()}")
+                return self._actual
+        except Exception as e:
+            print("❌ Error actualizando el delta de productos:", e)
+            return None
+        finally:
+            self._lock_recarga.release()
+
+        print(f"🧱 Delta con más de {max_items} productos: reconstruyendo el índice completo")
+        tenia_vecinos = self._actual.tabla_vecinos is not None
+        nuevo = self.recargar()
+        # El índice nuevo tiene otra huella: la tabla de vecinos anterior ya no vale
+        if nuevo is not None and tenia_vecinos and nuevo.tabla_vecinos is None:
+            self.recalcular_vecinos_en_segundo_plano()
+        return nuevo
+
+    def recalcular_vecinos(self):
+        """
+        Calcula y guarda la tabla de vecinos del índice vigente (como
+        `tareas.py vecinos`) y publica una versión que la usa.
+        """
+        actual = self._actual
+        print("🧮 Recalculando la tabla de vecinos del nuevo índice...")
+        try:
+            tabla = calcular_tabla_vecinos(actual.motor)
+            guardar_tabla_vecinos(tabla)
+        except Exception as e:
+            print("❌ No se pudo recalcular la tabla de vecinos; ejecuta `python tareas.py vecinos`:", e)
+            return None
+
+        with self._lock_recarga:
+            if self._actual.motor is not actual.motor:
+                print("⚠️ El índice cambió mientras se calculaba la tabla de vecinos; se usará en la próxima recarga si corresponde")
+                return None
+            self._actual = self._actual.con_tabla_vecinos(tabla)
+        print(f"✅ Tabla de vecinos actualizada: {self._actual.descripcion()}")
+        return self._actual
+
+    def recalcular_vecinos_en_segundo_plano(self):
+        """Lanza recalcular_vecinos en un hilo para no bloquear la compactación."""
+        hilo = threading.Thread(target=self.recalcular_vecinos, name="recalculo-vecinos", daemon=True)
+        hilo.start()
+        return hilo
+
+    def recargar_en_segundo_plano(self):
+        """Lanza la recarga en un hilo (p. ej. desde un manejador de señal)."""
+        hilo = threading.Thread(target=self.recargar, name="recarga-catalogo", daemon=True)
+        hilo.start()
+        return hilo
+
+
+__all__ = ["SnapshotCatalogo", "GestorCatalogo", "cargar_snapshot"]
@@ -1,8 +1,14 @@
+import asyncio
 import requests
-from telegram import InputMediaPhoto
+from telegram.error import RetryAfter
 from functools import wraps
 
-from app.responses import chain_descripcion_producto, chain_fuera_de_dominio
+from app.responses import chain_fuera_de_dominio
+from app.config import PLAZO_DESCRIPCIONES_S, STREAMING_INTERVALO_S, LLM_PLAZO_PASO_S
+from app.presupuesto import circuito_llm, plazo_paso
+
+# Longitud máxima de un mensaje de texto de Telegram
+MAX_TEXTO_TELEGRAM = 4096
 
 # URL por defecto si no hay imagen válida
 URL_IMAGEN_DEFAULT = "https://upload.wikimedia.org/wikipedia/commons/1/14/No_Image_Available.jpg"
@@ -17,64 +23,167 @@ def es_imagen_valida(url: str) -> bool:
     except:
         return False
 
-# 🔸 Envía una galería de productos con imagen + descripción a Telegram
-async def mostrar_productos_telegram(productos_df, update, context):
-    from app.estado import productos_mostrados
-
-    if productos_df.empty:
-        await update.message.reply_text("⚠️ No hay productos disponibles para mostrar.")
-        return
 
-    productos_df = productos_df.sample(min(5, len(productos_df)))  # hasta 5 productos
+# Función asíncrona para responder a mensajes fuera de dominio directamente en Telegram
+async def responder_fuera_de_dominio_telegram(mensaje_usuario, llm, update, context):
+    """
+    Genera una respuesta amable con el LLM para mensajes fuera del dominio del asistente
+    y la envía al usuario por Telegram a medida que se genera.
+    """
+    await responder_en_streaming(
+        update, chain_fuera_de_dominio, {"mensaje_usuario": mensaje_usuario},
+        "Solo puedo ayudarte con productos de moda. ¿Quieres que te recomiende algo?"
+    )
 
-    productos_mostrados.clear()
-    productos_mostrados.extend(productos_df.reset_index(drop=True).to_dict(orient="records"))
 
-    media_group = []
+# 🔸 Genera varios textos con el LLM a la vez (p. ej. los pies de foto de una galería)
+async def generar_textos_llm(runnable, entradas, texto_por_defecto, plazo=PLAZO_DESCRIPCIONES_S):
+    """
+    Lanza `runnable.ainvoke` para todas las entradas en paralelo y espera como
+    mucho `plazo` segundos en total (menos si no queda tanto presupuesto del
+    mensaje). Cada texto que falle o no llegue a tiempo se sustituye por
+    `texto_por_defecto`; el resto se conserva. Con el circuito del LLM
+    abierto no se llama y todos son `texto_por_defecto`.
+    """
+    if not entradas:
+        return []
+    plazo_efectivo = plazo_paso(plazo)
+    if plazo_efectivo <= 0 or not circuito_llm.permitir():
+        print("⏭️ Textos del LLM omitidos (sin presupuesto o circuito abierto); se usa el texto por defecto")
+        return [texto_por_defecto] * len(entradas)
 
-    for _, row in productos_df.iterrows():
-        nombre = row["productdisplayname"]
-        imagen = row.get("image_url") or URL_IMAGEN_DEFAULT
+    fallos = 0
 
+    async def generar(entrada):
+        nonlocal fallos
         try:
-            descripcion = chain_descripcion_producto.invoke({"nombre": nombre}).content.strip()
-        except:
-            descripcion = "(sin descripción)"
-
-        caption = f"*{nombre}*\n{descripcion}"[:1024]
-        media_group.append(InputMediaPhoto(media=imagen, caption=caption, parse_mode="Markdown"))
-
+            return (await runnable.ainvoke(entrada)).content.strip()
+        except Exception as e:
+            print("⚠️ Error generando texto con el LLM:", e)
+            fallos += 1
+            return texto_por_defecto
+
+    tareas = [asyncio.ensure_future(generar(entrada)) for entrada in entradas]
+    _, pendientes = await asyncio.wait(tareas, timeout=plazo_efectivo)
+    for tarea in pendientes:
+        tarea.cancel()
+    if pendientes:
+        print(f"⏱️ {len(pendientes)} de {len(tareas)} textos sin respuesta en {plazo_efectivo:.1f}s; se usa el texto por defecto")
+
+    # Para el circuito cuenta la galería entera: basta un texto a tiempo para darlo por sano
+    if fallos + len(pendientes) < len(tareas):
+        circuito_llm.exito()
+    elif fallos or plazo_efectivo >= plazo:
+        circuito_llm.fallo()
+    return [texto_por_defecto if tarea in pendientes else tarea.result() for tarea in tareas]
+
+
+async def _mostrar_parcial(mostrar, texto):
+    """
+    Llama a `mostrar`. Devuelve (si se mostró, segundos extra que Telegram pide
+    esperar antes de la siguiente edición).
+    """
     try:
-        await context.bot.send_media_group(chat_id=update.effective_chat.id, media=media_group)
+        await mostrar(texto)
+        return True, 0.0
+    except RetryAfter as e:
+        espera = e.retry_after
+        return False, espera.total_seconds() if hasattr(espera, "total_seconds") else float(espera)
     except Exception as e:
-        print(f"⚠️ Error al enviar galería: {e}")
-        # Fallback con imágenes validadas
-        media_group_fallback = []
-        for item in media_group:
-            imagen_final = item.media if es_imagen_valida(item.media) else URL_IMAGEN_DEFAULT
-            media_group_fallback.append(InputMediaPhoto(media=imagen_final, caption=item.caption, parse_mode="Markdown"))
-
-        try:
-            await context.bot.send_media_group(chat_id=update.effective_chat.id, media=media_group_fallback)
-        except Exception as e2:
-            print(f"❌ Fallo también con imágenes corregidas: {e2}")
-            await update.message.reply_text("❌ No se pudo mostrar la galería. Prueba con otra categoría.")
+        # "Message is not modified", red...: la siguiente edición lo corrige
+        print("⚠️ No se pudo actualizar el mensaje:", e)
+        return False, 0.0
 
 
-# Función asíncrona para responder a mensajes fuera de dominio directamente en Telegram
-async def responder_fuera_de_dominio_telegram(mensaje_usuario, llm, update, context):
+# 🔸 Muestra el texto del LLM a medida que se genera
+async def transmitir_texto_llm(runnable, entrada, mostrar, texto_por_defecto=None, intervalo=STREAMING_INTERVALO_S,
+                               mostrar_final=None, si_falla=None):
     """
-    Genera una respuesta amable con el LLM para mensajes fuera del dominio del asistente
-    y la envía al usuario por Telegram.
+    Consume `runnable.astream(entrada)` y llama a `await mostrar(texto)` con el
+    texto acumulado como mucho una vez cada `intervalo` segundos (Telegram
+    limita las ediciones por chat). El texto completo se muestra al final con
+    `mostrar_final` (p. ej. con Markdown, que no se puede aplicar a un texto a
+    medias) o, si no se da, con `mostrar`; si esa última edición falla se
+    llama a `si_falla(texto)` para que el usuario no se quede sin respuesta.
+
+    La respuesta tiene como mucho LLM_PLAZO_PASO_S segundos (recortados al
+    presupuesto del mensaje); si se agota se queda el texto recibido hasta
+    entonces. Devuelve (texto, completo): el texto es None si no llega
+    ningún fragmento a tiempo o el circuito está abierto, y en ese caso se
+    muestra `texto_por_defecto` si se da. `completo` es False si el stream
+    falló o se cortó por plazo: el texto mostrado es un fragmento y no debe
+    guardarse.
     """
-    try:
-        respuesta = chain_fuera_de_dominio.invoke({"mensaje_usuario": mensaje_usuario}).content.strip()
-
-    except Exception as e:
-        print("⚠️ Error al generar respuesta fuera de dominio:", e)
-        respuesta = "Solo puedo ayudarte con productos de moda. ¿Quieres que te recomiende algo?"
-
-    await update.message.reply_text(respuesta)
+    bucle = asyncio.get_running_loop()
+    texto, mostrado, proxima = "", "", 0.0
+    completo = True
+
+    async def consumir():
+        nonlocal texto, mostrado, proxima
+        async for fragmento in runnable.astream(entrada):
+            texto += fragmento.content or ""
+            if texto.strip() and texto != mostrado and bucle.time() >= proxima:
+                parcial = texto
+                ok, espera = await _mostrar_parcial(mostrar, parcial.strip())
+                if ok:
+                    mostrado = parcial
+                proxima = bucle.time() + intervalo + espera
+
+    plazo = plazo_paso(LLM_PLAZO_PASO_S)
+    if plazo > 0 and circuito_llm.permitir():
+        try:
+            await asyncio.wait_for(consumir(), plazo)
+            circuito_llm.exito()
+        except asyncio.TimeoutError:
+            print(f"⏱️ Respuesta en streaming cortada a los {plazo:.1f}s")
+            completo = False
+            if texto.strip():
+                circuito_llm.exito()
+            elif plazo >= LLM_PLAZO_PASO_S:
+                circuito_llm.fallo()
+        except Exception as e:
+            print("⚠️ Error en la respuesta en streaming del LLM:", e)
+            circuito_llm.fallo()
+            completo = False
+    else:
+        print("⏭️ Streaming del LLM omitido (sin presupuesto o circuito abierto)")
+
+    texto = texto.strip()
+    final = texto or texto_por_defecto
+    if final and (mostrar_final is not None or final != mostrado.strip()):
+        ok, espera = await _mostrar_parcial(mostrar_final or mostrar, final)
+        if not ok and espera:
+            # El texto final no se puede perder: se espera lo que pida Telegram y se reintenta una vez
+            await asyncio.sleep(espera)
+            ok, _ = await _mostrar_parcial(mostrar_final or mostrar, final)
+        if not ok and si_falla is not None:
+            try:
+                await si_falla(final)
+            except Exception as e:
+                print("❌ No se pudo enviar la respuesta final:", e)
+    return (texto or None), completo
+
+
+# 🔸 Responde con un único mensaje de texto que se va editando mientras el LLM genera
+async def responder_en_streaming(update, runnable, entrada, texto_por_defecto, mensaje=None):
+    """
+    Envía la respuesta de `runnable` al chat: el primer fragmento crea el
+    mensaje (o edita `mensaje`, si se da uno ya enviado) y los siguientes lo
+    editan. Devuelve el texto enviado.
+    """
+    async def mostrar(texto):
+        nonlocal mensaje
+        texto = texto[:MAX_TEXTO_TELEGRAM]
+        if mensaje is None:
+            mensaje = await update.message.reply_text(texto)
+        else:
+            await mensaje.edit_text(texto)
+
+    async def enviar_nuevo(texto):
+        await update.message.reply_text(texto[:MAX_TEXTO_TELEGRAM])
+
+    texto, _ = await transmitir_texto_llm(runnable, entrada, mostrar, texto_por_defecto, si_falla=enviar_nuevo)
+    return texto or texto_por_defecto
 
 
 # 🔸 Decorador que muestra un mensaje temporal "procesando..."
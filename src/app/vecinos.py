@@ -0,0 +1,112 @@
+import os
+import time
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from app.config import INDEX_DIR, VECINOS_K
+from app.artefactos import leer_json, guardar_array, guardar_json
+from app.indice import leer_meta_indice
+
+# Tabla de vecinos precalculada: posiciones int32 y similitudes float16, ambas [n_productos, K]
+RUTA_VECINOS_POS = os.path.join(INDEX_DIR, "vecinos_pos.npy")
+RUTA_VECINOS_SIM = os.path.join(INDEX_DIR, "vecinos_sim.npy")
+RUTA_VECINOS_META = os.path.join(INDEX_DIR, "vecinos_meta.json")
+
+TAM_BLOQUE = 1024
+
+
+class TablaVecinos:
+    """
+    Top-K vecinos de cada producto del catálogo. Las filas se indexan por la
+    posición del producto y los huecos se rellenan con -1.
+    """
+
+    def __init__(self, posiciones, similitudes):
+        self.posiciones = posiciones
+        self.similitudes = similitudes
+        self.k = posiciones.shape[1]
+
+    def __len__(self):
+        return self.posiciones.shape[0]
+
+    def cubre(self, pos, n):
+        """True si la tabla puede responder n vecinos del producto en `pos`."""
+        return 0 <= pos < len(self) and n <= self.k
+
+    def vecinos(self, pos, n):
+        """Lista de hasta n (posicion, similitud) ordenada por similitud."""
+        fila = self.posiciones[pos, :n]
+        sims = self.similitudes[pos, :n]
+        return [(int(i), round(float(s), 3)) for i, s in zip(fila, sims) if i >= 0]
+
+
+def calcular_tabla_vecinos(motor, k=VECINOS_K, n_jobs=None):
+    """
+    Calcula los K vecinos de todos los productos con el motor de similitud
+    dado, por bloques en paralelo (Annoy y BLAS liberan el GIL, basta con hilos).
+    """
+    n = motor.n_items()
+    posiciones = np.full((n, k), -1, dtype=np.int32)
+    similitudes = np.zeros((n, k), dtype=np.float16)
+
+    def calcular_bloque(inicio):
+        fin = min(inicio + TAM_BLOQUE, n)
+        vecinos, sims = motor.vecinos_lote(np.arange(inicio, fin), k)
+        posiciones[inicio:fin] = vecinos
+        similitudes[inicio:fin] = sims
+
+    inicio = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=n_jobs or os.cpu_count()) as pool:
+        for _ in pool.map(calcular_bloque, range(0, n, TAM_BLOQUE)):
+            pass
+
+    print(
+        f"⏱️ Tabla de vecinos calculada con el motor {motor.nombre}: "
+        f"{n} productos x {k} vecinos en {time.perf_counter() - inicio:.1f}s"
+    )
+    return TablaVecinos(posiciones, similitudes)
+
+
+def guardar_tabla_vecinos(tabla):
+    """Persiste la tabla asociada a la huella del índice con el que se calculó."""
+    meta_indice = leer_meta_indice() or {}
+    os.makedirs(INDEX_DIR, exist_ok=True)
+    guardar_array(RUTA_VECINOS_POS, tabla.posiciones)
+    guardar_array(RUTA_VECINOS_SIM, tabla.similitudes)
+    guardar_json(RUTA_VECINOS_META, {
+        "huella": meta_indice.get("huella"),
+        "k": tabla.k,
+        "n_items": len(tabla),
+        "creado": datetime.now().isoformat(timespec="seconds"),
+    })
+
+
+def cargar_tabla_vecinos(n_items):
+    """
+    Carga la tabla con mmap si corresponde al índice persistido actual y al
+    número de items del índice en uso. Devuelve None si no existe o está
+    desactualizada.
+    """
+    meta = leer_json(RUTA_VECINOS_META)
+    meta_indice = leer_meta_indice()
+    if not meta or not meta_indice:
+        return None
+    if not meta.get("huella") or meta.get("huella") != meta_indice.get("huella") or meta.get("n_items") != n_items:
+        print("⚠️ La tabla de vecinos no corresponde al índice actual; se usará el índice en vivo")
+        return None
+
+    try:
+        tabla = TablaVecinos(
+            np.load(RUTA_VECINOS_POS, mmap_mode="r"),
+            np.load(RUTA_VECINOS_SIM, mmap_mode="r")
+        )
+        print(f"✅ Tabla de vecinos cargada: {len(tabla)} productos x {tabla.k} vecinos")
+        return tabla
+    except Exception as e:
+        print("⚠️ No se pudo cargar la tabla de vecinos:", e)
+        return None
+
+
+__all__ = ["TablaVecinos", "calcular_tabla_vecinos", "guardar_tabla_vecinos", "cargar_tabla_vecinos"]
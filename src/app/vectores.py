@@ -0,0 +1,142 @@
+import os
+import numpy as np
+
+from app.artefactos import guardar_array
+
+MODOS = ("float32", "float16", "int8")
+
+# Filas que se decuantizan a la vez al recorrer la matriz
+TAM_BLOQUE = 16384
+
+
+class MatrizFeatures:
+    """
+    Matriz de features con filas normalizadas, guardada en float32, float16 o
+    int8 con una escala por columna (valor ≈ dato * escala).
+
+    Las operaciones trabajan por bloques de filas, así que nunca se
+    decuantiza la matriz completa en memoria. Las normas de las filas
+    decuantizadas se guardan aparte para que las similitudes sigan siendo
+    cosenos después de cuantizar.
+    """
+
+    def __init__(self, datos, escalas=None, normas=None):
+        self.datos = datos
+        self.escalas = escalas
+        self.normas = normas
+
+    @property
+    def modo(self):
+        return self.datos.dtype.name
+
+    @property
+    def shape(self):
+        return self.datos.shape
+
+    def __len__(self):
+        return self.datos.shape[0]
+
+    @property
+    def nbytes(self):
+        extra = sum(a.nbytes for a in (self.escalas, self.normas) if a is not None)
+        return self.datos.nbytes + extra
+
+    @classmethod
+    def cuantizar(cls, matriz, modo="float32"):
+        """Crea la representación compacta de una matriz float32 ya normalizada por filas."""
+        if modo not in MODOS:
+            raise ValueError(f"Modo de features desconocido: {modo}")
+        if modo == "float32":
+            return cls(np.ascontiguousarray(matriz, dtype=np.float32))
+
+        if modo == "float16":
+            datos = matriz.astype(np.float16)
+            escalas = None
+        else:
+            # Cuantización simétrica por columna: el máximo absoluto de cada columna se lleva a 127
+            maximos = np.abs(matriz).max(axis=0) if len(matriz) else np.zeros(matriz.shape[1], dtype=np.float32)
+            escalas = np.where(maximos > 0, maximos / 127.0, 1.0).astype(np.float32)
+            datos = np.empty(matriz.shape, dtype=np.int8)
+            for inicio in range(0, len(matriz), TAM_BLOQUE):
+                bloque = matriz[inicio:inicio + TAM_BLOQUE] / escalas
+                datos[inicio:inicio + TAM_BLOQUE] = np.clip(np.rint(bloque), -127, 127)
+
+        matriz_q = cls(datos, escalas)
+        normas = np.empty(len(datos), dtype=np.float32)
+        for inicio, bloque in matriz_q._bloques_sin_normalizar():
+            normas[inicio:inicio + len(bloque)] = np.linalg.norm(bloque, axis=1)
+        normas[normas == 0] = 1.0
+        matriz_q.normas = normas
+        return matriz_q
+
+    def _decuantizar(self, datos):
+        bloque = datos.astype(np.float32)
+        if self.escalas is not None:
+            bloque *= self.escalas
+        return bloque
+
+    def _bloques_sin_normalizar(self, tam=TAM_BLOQUE):
+        for inicio in range(0, len(self), tam):
+            yield inicio, self._decuantizar(self.datos[inicio:inicio + tam])
+
+    def filas(self, posiciones):
+        """Vectores float32 normalizados de las posiciones dadas."""
+        bloque = self._decuantizar(self.datos[posiciones])
+        if self.normas is not None:
+            bloque /= self.normas[posiciones][..., None]
+        return bloque
+
+    def bloques(self, tam=TAM_BLOQUE):
+        """Recorre la matriz como (inicio, bloque float32 normalizado)."""
+        for inicio in range(0, len(self), tam):
+            yield inicio, self.filas(slice(inicio, inicio + tam))
+
+    def similitudes(self, consultas, posiciones=None):
+        """
+        Coseno entre las consultas (float32 normalizadas, [b, d]) y todas las
+        filas de la matriz, o solo las de `posiciones`. Devuelve [b, n].
+        """
+        consultas = np.atleast_2d(np.asarray(consultas, dtype=np.float32))
+        if posiciones is not None:
+            posiciones = np.asarray(posiciones)
+            resultado = np.empty((consultas.shape[0], len(posiciones)), dtype=np.float32)
+            for inicio in range(0, len(posiciones), TAM_BLOQUE):
+                bloque = posiciones[inicio:inicio + TAM_BLOQUE]
+                resultado[:, inicio:inicio + len(bloque)] = consultas @ self.filas(bloque).T
+            return resultado
+
+        if self.modo == "float32" and self.normas is None:
+            return consultas @ self.datos.T
+
+        # La escala por columna se aplica a la consulta y la norma por fila al resultado
+        if self.escalas is not None:
+            consultas = consultas * self.escalas
+        resultado = np.empty((consultas.shape[0], len(self)), dtype=np.float32)
+        for inicio in range(0, len(self), TAM_BLOQUE):
+            fin = min(inicio + TAM_BLOQUE, len(self))
+            resultado[:, inicio:fin] = consultas @ self.datos[inicio:fin].astype(np.float32).T
+            if self.normas is not None:
+                resultado[:, inicio:fin] /= self.normas[inicio:fin]
+        return resultado
+
+    def guardar(self, ruta):
+        """Persiste datos, escalas y normas como .npy junto a `ruta`."""
+        base = os.path.splitext(ruta)[0]
+        guardar_array(ruta, self.datos)
+        if self.escalas is not None:
+            guardar_array(f"{base}_escalas.npy", self.escalas)
+        if self.normas is not None:
+            guardar_array(f"{base}_normas.npy", self.normas)
+
+    @classmethod
+    def cargar(cls, ruta, mmap_mode="r"):
+        """Carga la matriz persistida con guardar() (mapeada en memoria por defecto)."""
+        base = os.path.splitext(ruta)[0]
+        datos = np.load(ruta, mmap_mode=mmap_mode)
+        # Solo int8 lleva escalas y solo los modos cuantizados llevan normas
+        escalas = np.load(f"{base}_escalas.npy") if datos.dtype == np.int8 else None
+        normas = np.load(f"{base}_normas.npy") if datos.dtype != np.float32 else None
+        return cls(datos, escalas, normas)
+
+
+__all__ = ["MODOS", "MatrizFeatures"]
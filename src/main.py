@@ -1,11 +1,16 @@
+import signal
+import asyncio
 from telegram.ext import ApplicationBuilder, CommandHandler, MessageHandler, filters
 from telegram import Update
 from telegram.ext import ContextTypes
 
 from app.intents import manejar_mensaje
+from app.recomendador import gestor_catalogo, cache_busquedas
 from app.estado import get_estado, reset_estado, limpiar_estados_inactivos
-from app.config import TELEGRAM_BOT_TOKEN
-from app.utils import con_mensaje_temporal
+from app.config import TELEGRAM_BOT_TOKEN, ADMIN_CHAT_IDS, DELTA_INTERVALO_S, CLIENTES_INTERVALO_S
+from app.clientes import directorio_clientes
+from app.utils import con_mensaje_temporal, responder_en_streaming
+from app.presupuesto import con_presupuesto, circuito_llm
 from app.responses import chain_bienvenida
 
 # --- Handlers de comandos ---
@@ -17,7 +22,27 @@ async def configurar_tareas_periodicas(application):
         callback=lambda context: limpiar_estados_inactivos(minutos=60),
         interval=600  # cada 10 minutos
     )
+    print("🛠️ Configurando actualización periódica de productos nuevos...")
+    application.job_queue.run_repeating(
+        callback=actualizar_productos_nuevos,
+        interval=DELTA_INTERVALO_S
+    )
+
+    print("🛠️ Configurando recarga periódica del directorio de clientes...")
+    application.job_queue.run_repeating(
+        callback=recargar_directorio_clientes,
+        interval=CLIENTES_INTERVALO_S,
+        first=0  # primera carga nada más arrancar, sin retrasar el inicio del bot
+    )
+
+async def recargar_directorio_clientes(context):
+    await asyncio.to_thread(directorio_clientes.recargar)
 
+async def actualizar_productos_nuevos(context):
+    # Consulta y compactación en un hilo para no bloquear el bucle de eventos
+    await asyncio.to_thread(gestor_catalogo.actualizar_delta)
+
+@con_presupuesto
 @con_mensaje_temporal
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     chat_id = update.effective_chat.id
@@ -37,13 +62,11 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
         "nombre": nombre_mostrar
     }
 
-    try:
-        mensaje = chain_bienvenida.invoke(entrada).content.strip()
-    except Exception as e:
-        print("⚠️ Error generando bienvenida con LLM:", e)
-        mensaje = "👋 ¡Hola! Soy tu asistente de moda. ¿Te gustaría ver una prenda o identificarte como cliente?"
-
-    await update.message.reply_text(mensaje)
+    # La bienvenida se muestra a medida que el LLM la genera
+    await responder_en_streaming(
+        update, chain_bienvenida, entrada,
+        "👋 ¡Hola! Soy tu asistente de moda. ¿Te gustaría ver una prenda o identificarte como cliente?"
+    )
 
 async def reset(update: Update, context: ContextTypes.DEFAULT_TYPE):
     chat_id = update.effective_chat.id
@@ -62,7 +85,27 @@ async def reset(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 async def estado(update: Update, context: ContextTypes.DEFAULT_TYPE):
     from app.estado import estados_usuarios
-    await update.message.reply_text(f"📊 Estados activos: {len(estados_usuarios)} usuarios.")
+    await update.message.reply_text(
+        f"📊 Estados activos: {len(estados_usuarios)} usuarios.\n"
+        f"📦 Catálogo {gestor_catalogo.actual().descripcion()}\n"
+        f"🗃️ Caché de búsquedas: {cache_busquedas.descripcion()}\n"
+        f"👥 Directorio de clientes: {len(directorio_clientes)} clientes, caché {directorio_clientes.cache.descripcion()}\n"
+        f"🔌 Circuito del LLM: {circuito_llm.descripcion()}"
+    )
+
+# 🔄 Recarga en caliente del catálogo (solo administradores)
+async def recargar(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if update.effective_chat.id not in ADMIN_CHAT_IDS:
+        await update.message.reply_text("⛔ Comando no autorizado.")
+        return
+
+    await update.message.reply_text("🔄 Recargando catálogo en segundo plano...")
+    # La construcción va en un hilo: el bot sigue atendiendo con la versión actual
+    nuevo = await asyncio.to_thread(gestor_catalogo.recargar)
+    if nuevo:
+        await update.message.reply_text(f"✅ Catálogo recargado: {nuevo.descripcion()}")
+    else:
+        await update.message.reply_text("⚠️ No se pudo recargar (fallo o recarga ya en curso). Sigue activa la versión anterior.")
 
 async def handle_all(update: Update, context: ContextTypes.DEFAULT_TYPE):
     chat_id = update.effective_chat.id
@@ -78,6 +121,10 @@ def main():
     app.add_handler(CommandHandler("start", start))
     app.add_handler(CommandHandler("reset", reset))
     app.add_handler(CommandHandler("estado", estado))
+    app.add_handler(CommandHandler("recargar", recargar, block=False))
+
+    # `kill -HUP <pid>` también recarga el catálogo
+    signal.signal(signal.SIGHUP, lambda signum, frame: gestor_catalogo.recargar_en_segundo_plano())
     
     # Mensajes de texto
     app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, manejar_mensaje))
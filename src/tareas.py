@@ -0,0 +1,171 @@
+import time
+import asyncio
+import argparse
+
+import numpy as np
+
+from app.indice import cargar_o_construir_indice
+from app.atributos import leer_atributos
+from app.archivo_catalogo import huella_productos, exportar_catalogo
+from app.db import leer_sql
+from app.vecinos import calcular_tabla_vecinos, guardar_tabla_vecinos
+from app.historial import construir_historial, guardar_historial
+from app.similitud import MotorAnnoy, MotorExacto, crear_motor
+from app.config import VECINOS_K, SIMILARITY_BACKEND
+
+# --- Tareas offline del recomendador (se ejecutan fuera del bot) ---
+
+def tarea_indice(args):
+    """Construye (si hace falta) y persiste el índice Annoy."""
+    cargar_o_construir_indice()
+
+
+def tarea_exportar(args):
+    """Exporta el catálogo de products a Parquet para arrancar el bot sin base de datos."""
+    huella = huella_productos()
+    df = leer_atributos()
+    cargar_o_construir_indice()
+    exportar_catalogo(df, huella)
+
+
+def tarea_vecinos(args):
+    """Precalcula la tabla top-K de vecinos de todos los productos."""
+    annoy_index, _, _, features = cargar_o_construir_indice()
+    motor = crear_motor(annoy_index, features, args.motor or SIMILARITY_BACKEND)
+    tabla = calcular_tabla_vecinos(motor, k=args.k, n_jobs=args.jobs)
+    guardar_tabla_vecinos(tabla)
+    print("💾 Tabla de vecinos guardada")
+
+
+def tarea_historial(args):
+    """Precalcula el historial de productos de cada cliente a partir de click_stream."""
+    guardar_historial(construir_historial())
+    print("💾 Historial de clientes guardado")
+
+
+# Productos ordenados por número de eventos en el click-stream (los más vistos primero)
+query_mas_vistos = """
+SELECT pem.product_id, p.productdisplayname
+FROM product_event_metadata pem
+JOIN products p ON p.id = pem.product_id
+GROUP BY pem.product_id, p.productdisplayname
+ORDER BY count(*) DESC
+"""
+
+
+async def generar_descripciones(tipo, productos, variante, concurrencia):
+    """
+    Genera y guarda las descripciones de (product_id, nombre) en tandas de
+    `concurrencia` llamadas. Devuelve (generadas, fallidas).
+    """
+    from app.descripciones import almacen_descripciones, TIPOS_DESCRIPCION
+    from app.utils import generar_textos_llm
+
+    chain = TIPOS_DESCRIPCION[tipo][0]
+    nombres = dict(productos)
+    pendientes = almacen_descripciones.pendientes(tipo, list(nombres), variante)
+    print(f"📝 {tipo}/{variante or '-'}: {len(pendientes)} de {len(nombres)} productos sin descripción")
+
+    generadas = fallidas = 0
+    for inicio in range(0, len(pendientes), concurrencia):
+        tanda = pendientes[inicio:inicio + concurrencia]
+        if tipo == "breve":
+            entradas = [{"nombre": nombres[pid]} for pid in tanda]
+        else:
+            entradas = [{"nombre_producto": nombres[pid], "cliente_identificado": variante} for pid in tanda]
+        textos = await generar_textos_llm(chain, entradas, None, plazo=120)
+        nuevos = {pid: texto for pid, texto in zip(tanda, textos) if texto}
+        almacen_descripciones.guardar(tipo, nuevos, variante)
+        generadas += len(nuevos)
+        fallidas += len(tanda) - len(nuevos)
+        print(f"   {min(inicio + concurrencia, len(pendientes))}/{len(pendientes)} procesados, {generadas} generadas, {fallidas} fallidas")
+    return generadas, fallidas
+
+
+def tarea_descripciones(args):
+    """Pregenera descripciones del catálogo (o de los más vistos) para no llamar al LLM al mostrarlos."""
+    if args.mas_vistos:
+        df = leer_sql(query_mas_vistos + " LIMIT %(n)s", {"n": args.mas_vistos})
+    else:
+        df = leer_atributos()
+    productos = list(zip(df["product_id"].astype(int), df["productdisplayname"].fillna("")))
+
+    tipos = ["breve", "ampliada"] if args.tipo == "todas" else [args.tipo]
+
+    async def generar_todas():
+        # Un solo bucle de eventos: el cliente async del LLM queda ligado al primero que lo usa
+        resumen = []
+        for tipo in tipos:
+            # La descripción ampliada depende de si el cliente está identificado
+            for variante in ([""] if tipo == "breve" else ["sí", "no"]):
+                resumen.append((tipo, variante, *await generar_descripciones(tipo, productos, variante, args.concurrencia)))
+        return resumen
+
+    for tipo, variante, generadas, fallidas in asyncio.run(generar_todas()):
+        aviso = "⚠️" if fallidas else "✅"
+        print(f"{aviso} {tipo}/{variante or '-'}: {generadas} generadas, {fallidas} fallidas")
+
+
+def tarea_comparar_motores(args):
+    """Mide latencia por consulta y recall@k de Annoy frente a la búsqueda exacta."""
+    annoy_index, _, _, features = cargar_o_construir_indice()
+    motores = [MotorAnnoy(annoy_index), MotorExacto(features)]
+    n = motores[0].n_items()
+    muestra = np.random.default_rng(0).choice(n, size=min(args.muestra, n), replace=False)
+
+    resultados = {}
+    for motor in motores:
+        tiempos = []
+        resultados[motor.nombre] = []
+        for pos in muestra:
+            inicio = time.perf_counter()
+            vecinos = motor.vecinos(int(pos), args.k)
+            tiempos.append((time.perf_counter() - inicio) * 1000)
+            resultados[motor.nombre].append({i for i, _ in vecinos})
+        p50, p95 = np.percentile(tiempos, [50, 95])
+        print(f"⏱️ {motor.nombre}: p50 {p50:.2f} ms, p95 {p95:.2f} ms por consulta")
+
+    aciertos = [
+        len(aprox & exacto) / max(len(exacto), 1)
+        for aprox, exacto in zip(resultados["annoy"], resultados["exacto"])
+    ]
+    print(f"🎯 Recall@{args.k} de Annoy frente al exacto: {np.mean(aciertos):.3f} ({len(muestra)} consultas)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Tareas offline del recomendador")
+    sub = parser.add_subparsers(dest="tarea", required=True)
+
+    p = sub.add_parser("indice", help="construir y persistir el índice Annoy")
+    p.set_defaults(func=tarea_indice)
+
+    p = sub.add_parser("exportar", help="exportar el catálogo a Parquet")
+    p.set_defaults(func=tarea_exportar)
+
+    p = sub.add_parser("vecinos", help="precalcular la tabla top-K de vecinos")
+    p.add_argument("--k", type=int, default=VECINOS_K, help="vecinos por producto")
+    p.add_argument("--jobs", type=int, default=None, help="hilos de cálculo (por defecto, todos los núcleos)")
+    p.add_argument("--motor", choices=["annoy", "exacto"], default=None, help="motor de similitud (por defecto, SIMILARITY_BACKEND)")
+    p.set_defaults(func=tarea_vecinos)
+
+    p = sub.add_parser("historial", help="precalcular el historial de productos por cliente")
+    p.set_defaults(func=tarea_historial)
+
+    p = sub.add_parser("descripciones", help="pregenerar descripciones de productos con el LLM")
+    p.add_argument("--tipo", choices=["breve", "ampliada", "todas"], default="breve", help="descripciones a generar")
+    p.add_argument("--mas-vistos", type=int, default=None, help="solo los N productos más vistos (por defecto, todo el catálogo)")
+    p.add_argument("--concurrencia", type=int, default=8, help="llamadas simultáneas al LLM")
+    p.set_defaults(func=tarea_descripciones)
+
+    p = sub.add_parser("comparar-motores", help="medir latencia y recall de los motores de similitud")
+    p.add_argument("--k", type=int, default=10, help="vecinos por consulta")
+    p.add_argument("--muestra", type=int, default=500, help="productos consultados")
+    p.set_defaults(func=tarea_comparar_motores)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+# --- Entry point ---
+if __name__ == "__main__":
+    main()